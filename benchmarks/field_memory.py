@@ -0,0 +1,52 @@
+"""
+Measure the memory used by each field, with tracemalloc.  Fields with the same options share
+their FieldSpec, so this should stay small as the number of fields grows.
+
+Run from the root of the repository:
+
+    python benchmarks/field_memory.py
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import easyforms
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+
+def build_fields(count):
+    return [easyforms.TextField('field-{}'.format(i), width=6, css_class='input-sm')
+            for i in range(count)]
+
+
+def measure(count):
+    """
+    Build some fields and measure the memory they hold on to
+
+    :return: The number of bytes per field
+    """
+    tracemalloc.start()
+    try:
+        fields = build_fields(count)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    del fields
+    return size / count
+
+
+def main():
+    # Build a few first, so that imports and caches aren't counted
+    build_fields(10)
+
+    for count in (1000, 5000, 20000):
+        print('{:>6} fields: {:>6.0f} bytes/field'.format(count, measure(count)))
+
+
+if __name__ == '__main__':
+    main()
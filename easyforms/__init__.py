@@ -10,4 +10,8 @@ from .advancedfields import *
 from .cmsfields import *
 from .dbfields import *
 from .formtype import *
+from .schema import FormSchema, FormSchemaSection
+from .submission import Submission
+from . import contentindex
 from .config import CkeditorConfig
+from .env import init_production_mode, template_cache
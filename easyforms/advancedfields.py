@@ -8,15 +8,20 @@ import re
 import io
 from collections import OrderedDict
 
-from flask import request, url_for
+from flask import after_this_request, has_request_context, url_for
 from littlefish import timetool
 from littlefish import htmlutil
-import requests
 
 from . import basicfields
+from . import chunkedupload
+from . import imagederivatives
+from . import parkedupload
+from . import recaptcha
+from . import options
+from . import uploads
+from . import exceptions
 from . import validate
 from . import form
-from .env import env
 from .config import CkeditorConfig
 
 __author__ = 'Stephen Brown (Little Fish Solutions LTD)'
@@ -128,6 +133,8 @@ class PostcodeField(basicfields.TextField):
 
 
 class ColourField(basicfields.TextField):
+    template = 'advanced/colour.html'
+
     def __init__(self, name, input_max_width=60, **kwargs):
         """
         :param name: The name of the field (the name field in the generated input)
@@ -135,9 +142,6 @@ class ColourField(basicfields.TextField):
         super().__init__(name, 'color', **kwargs)
         self._input_max_width = input_max_width
 
-    def render(self):
-        return env.get_template('advanced/colour.html').render(field=self)
-
     def convert_value(self):
         if self.value is not None:
             self.value = self.value.lower()
@@ -155,14 +159,15 @@ class ColourField(basicfields.TextField):
 
 
 class GenderField(form.Field):
+    template = 'advanced/gender.html'
+
     def __init__(self, name, **kwargs):
         super(GenderField, self).__init__(name, allow_missing=True, **kwargs)
 
-    def render(self):
-        return env.get_template('advanced/gender.html').render(field=self)
-
 
 class DateSelectField(form.Field):
+    template = 'advanced/date_select.html'
+
     def __init__(self, name, years=None, **kwargs):
         super().__init__(name, **kwargs)
 
@@ -172,11 +177,21 @@ class DateSelectField(form.Field):
         else:
             self.years = years
 
-    def render(self):
-        return env.get_template('advanced/date_select.html')\
-            .render(field=self, day=self.value.day if self.value else None,
-                    month=self.value.month if self.value else None, year=self.value.year if self.value else None,
-                    this_year=datetime.datetime.now().year)
+    def get_template_context(self):
+        day = self.value.day if self.value else None
+        month = self.value.month if self.value else None
+        year = self.value.year if self.value else None
+
+        return {
+            'field': self,
+            'day': day,
+            'month': month,
+            'year': year,
+            'this_year': datetime.datetime.now().year,
+            'day_options': options.render_selected(options.DAY_OPTIONS, day),
+            'month_options': options.render_selected(options.MONTH_OPTIONS, month),
+            'year_options': options.render_selected(options.get_year_options(self.years), year)
+        }
 
     def extract_value(self, data):
         day_str = data['%s-day' % self.name]
@@ -201,6 +216,8 @@ class DateSelectField(form.Field):
 
 
 class YearMonthSelectField(form.Field):
+    template = 'advanced/year_month_select.html'
+
     def __init__(self, name, years=None, **kwargs):
         super(YearMonthSelectField, self).__init__(name, **kwargs)
         
@@ -210,11 +227,18 @@ class YearMonthSelectField(form.Field):
         else:
             self.years = years
 
-    def render(self):
-        return env.get_template('advanced/year_month_select.html')\
-            .render(field=self, month=self.value.month if self.value else None,
-                    year=self.value.year if self.value else None,
-                    this_year=datetime.datetime.now().year)
+    def get_template_context(self):
+        month = self.value.month if self.value else None
+        year = self.value.year if self.value else None
+
+        return {
+            'field': self,
+            'month': month,
+            'year': year,
+            'this_year': datetime.datetime.now().year,
+            'month_options': options.render_selected(options.MONTH_OPTIONS, month),
+            'year_options': options.render_selected(options.get_year_options(self.years), year)
+        }
 
     def extract_value(self, data):
         month_str = data['%s-month' % self.name]
@@ -239,17 +263,19 @@ class DatePickerField(form.Field):
     """
     You must enable the date picker javascript for this to work!
     """
+    template = 'advanced/date_picker.html'
+
     def __init__(self, name, **kwargs):
         if 'width' not in kwargs:
             kwargs['width'] = 3
         super(DatePickerField, self).__init__(name, css_class='date-picker', **kwargs)
 
-    def render(self):
+    def get_template_context(self):
         date = self.value
         if date is not None:
             date = timetool.datetime_to_datepicker(date)
 
-        return env.get_template('advanced/date_picker.html').render(field=self, date=date)
+        return {'field': self, 'date': date}
 
     def convert_value(self):
         if self.value is not None:
@@ -264,17 +290,19 @@ class DateTimeField(form.Field):
     """
     You must enable the date picker javascript for this to work!
     """
+    template = 'advanced/date_time.html'
+
     def __init__(self, name, **kwargs):
         if 'width' not in kwargs:
             kwargs['width'] = 3
         super().__init__(name, **kwargs)
 
-    def render(self):
+    def get_template_context(self):
         date = self.value
         if date is not None:
             date = timetool.datetime_to_datepicker(date)
 
-        return env.get_template('advanced/date_time.html').render(field=self, date=date)
+        return {'field': self, 'date': date}
 
     def extract_value(self, data):
         date_str = data['%s-date' % self.name]
@@ -338,13 +366,12 @@ class ListSelectField(basicfields.SelectField):
 
         
 class ListRadiosField(ListSelectField):
+    template = 'basic/radios.html'
+
     def __init__(self, name, values, empty_option_name='(none)', **kwargs):
 
         super().__init__(name, values, empty_option_name=empty_option_name, allow_missing=True, **kwargs)
 
-    def render(self):
-        return env.get_template('basic/radios.html').render(field=self)
-
 
 class ObjectListSelectField(basicfields.SelectField):
     """
@@ -356,24 +383,36 @@ class ObjectListSelectField(basicfields.SelectField):
 
     def convert_value(self):
         if self.value:
-            for key_pair in self.key_pairs:
-                if str(key_pair.select_value) == self.value:
-                    self.value = key_pair
+            option_list, key_pairs = self.get_option_list()
+            if option_list is not None:
+                positions = option_list.find_str(self.value)
+                if positions:
+                    self.value = key_pairs[positions[0]]
                     return
+            else:
+                for key_pair in self.key_pairs:
+                    if str(key_pair.select_value) == self.value:
+                        self.value = key_pair
+                        return
 
             self.error = 'Invalid Value'
 
 
 class ObjectListRadiosField(ListSelectField):
+    template = 'basic/radios.html'
+
     def __init__(self, name, key_pairs, empty_option_name='(none)', **kwargs):
 
         super().__init__(name, key_pairs, empty_option_name=empty_option_name, allow_missing=True, **kwargs)
 
-    def render(self):
-        return env.get_template('basic/radios.html').render(field=self)
-
 
 class EnumSelectField(basicfields.SelectField):
+    template = 'advanced/enum_select.html'
+
+    option_value_attribute = 'value'
+    option_name_attribute = 'name'
+    select_by_option_value = False
+
     def __init__(self, name, enum_class, **kwargs):
         class KeyPair(object):
             def __init__(self, x):
@@ -384,17 +423,21 @@ class EnumSelectField(basicfields.SelectField):
 
         self.enum_class = enum_class
 
-    def render(self):
-        return env.get_template('advanced/enum_select.html').render(field=self)
-
     def convert_value(self):
         if not self.value:
             return
 
-        for item in self.enum_class:
-            if item.value == self.value:
-                self.value = item
+        option_list, items = self.get_option_list()
+        if option_list is not None:
+            positions = option_list.find(self.value)
+            if positions:
+                self.value = items[positions[0]]
                 return
+        else:
+            for item in self.enum_class:
+                if item.value == self.value:
+                    self.value = item
+                    return
 
         self.error = 'Invalid value: {}'.format(self.value)
         self.value = None
@@ -439,6 +482,9 @@ class CkeditorField(basicfields.TextAreaField):
     """
     HTML Editor using CKEditor
     """
+    template = 'advanced/ckeditor.html'
+    heavy = True
+
     def __init__(self, name, config=CkeditorConfig(), height=None, on_change=None, **kwargs):
 
         super().__init__(name, **kwargs)
@@ -447,9 +493,6 @@ class CkeditorField(basicfields.TextAreaField):
         self.height = height
         self.on_change = on_change
 
-    def render(self):
-        return env.get_template('advanced/ckeditor.html').render(field=self)
-
     def convert_value(self):
         if self.value is not None and self.config.strip_nbsp:
             self.value = re.sub(r'\s?&nbsp;\s?', ' ', self.value)
@@ -483,20 +526,22 @@ class FilemanagerField(UrlField):
     """
     Only one of these per rendered page is supported!
     """
+    template = 'advanced/filemanager.html'
+
     def __init__(self, name, filemanager_url='/fm/index.html', **kwargs):
         super().__init__(name, **kwargs)
 
         self.filemanager_url = filemanager_url
 
-    def render(self):
-        return env.get_template('advanced/filemanager.html').render(field=self)
-
 
 class HtmlField(basicfields.TextAreaField):
     """
     This field is deprecated and should no longer be used.  Please us CkeditorField
     instead
     """
+    template = 'advanced/deprecated_html_field.html'
+    heavy = True
+
     def __init__(self, name, no_smiley=True, no_image=True, no_nbsp=True, height=None,
                  on_change=None, pretty_print=False, strip_empty_paragraphs=True,
                  entities_latin=True, pretty_print_line_length=110,
@@ -518,9 +563,6 @@ class HtmlField(basicfields.TextAreaField):
         else:
             self.ckeditor_url = url_for('static', filename='ckeditor/ckeditor.js')
 
-    def render(self):
-        return env.get_template('advanced/deprecated_html_field.html').render(field=self)
-
     def convert_value(self):
         if self.value is not None and self.no_nbsp:
             self.value = re.sub(r'\s?&nbsp;\s?', ' ', self.value)
@@ -534,12 +576,11 @@ class HtmlField(basicfields.TextAreaField):
 
 
 class TimeInputField(form.Field):
+    template = 'advanced/time_input.html'
+
     def __init__(self, name, **kwargs):
         super(TimeInputField, self).__init__(name, **kwargs)
 
-    def render(self):
-        return env.get_template('advanced/time_input.html').render(field=self)
-
     def extract_value(self, data):
         hour_str = data['%s-hour' % self.name]
         minute_str = data['%s-minute' % self.name]
@@ -556,7 +597,35 @@ class TimeInputField(form.Field):
 
 
 class FileUploadField(form.Field):
-    def __init__(self, name, accept, disable_submitted_warning=False, **kwargs):
+    template = 'advanced/file_upload.html'
+
+    def __init__(self, name, accept, disable_submitted_warning=False, max_bytes=None, sink=None,
+                 hash_algorithm=None, chunked=False, content_index=None, park_uploads=False,
+                 **kwargs):
+        """
+        :param max_bytes: The largest file, in bytes, that can be uploaded.  Larger files are
+                          rejected before (or as soon as) the limit is exceeded while copying
+                          them into the sink.  The request has already been received and parsed
+                          by then, so set MAX_CONTENT_LENGTH to limit what the server accepts
+        :param sink: Where to copy the upload to, i.e. uploads.SpooledSink() or
+                     uploads.DirectorySink(path).  This determines the type of the value.  If
+                     max_bytes or hash_algorithm is set this defaults to uploads.MemorySink(),
+                     so the value is the file contents as bytes
+        :param hash_algorithm: Name of a hashlib algorithm, i.e. 'sha256'.  If set, the hex
+                               digest of the upload is calculated while it's copied and stored
+                               in digest
+        :param chunked: If True, the browser sends the file in chunks to the chunked upload
+                        blueprint before the form is submitted, and the form just submits a
+                        token.  Requires chunkedupload.init_chunked_uploads()
+        :param content_index: A contentindex.MemoryContentIndex or DirectoryContentIndex.  The
+                              digest of each upload is looked up in the index, and duplicate
+                              and known_content are set if it's there.  Call remember_content()
+                              once a new upload has been stored.  hash_algorithm defaults to
+                              'sha256' if this is set
+        :param park_uploads: If True, an accepted upload is kept when the form is shown again
+                             because of an error in another field, so the user doesn't have to
+                             select it again.  Requires parkedupload.init_parked_uploads()
+        """
         super(FileUploadField, self).__init__(name, requires_multipart=True, allow_missing=True, **kwargs)
 
         self.accept = accept
@@ -564,16 +633,108 @@ class FileUploadField(form.Field):
         self.file = None
         self.filename = None
         self.disable_submitted_warning = disable_submitted_warning
+        self.max_bytes = max_bytes
+        self.sink = sink
+        self.hash_algorithm = hash_algorithm
+        self.size = None
+        self.digest = None
+        self.chunked = chunked
+        self.upload_token = None
+        self._claimed_upload = None
+        self.content_index = content_index
+        self.known_content = None
+        self.park_uploads = park_uploads
+        self._parked_token = None
+
+        if content_index is not None and hash_algorithm is None:
+            self.hash_algorithm = 'sha256'
 
-    def render(self):
-        return env.get_template('advanced/file_upload.html').render(field=self)
+    @property
+    def duplicate(self):
+        """True if the upload is already in the content index"""
+        return self.known_content is not None
+
+    @property
+    def token_name(self):
+        """The name of the hidden input holding the chunked upload token"""
+        return '{}-upload-token'.format(self.name)
+
+    @property
+    def parked_token_name(self):
+        """The name of the hidden input holding the parked upload token"""
+        return '{}-parked-token'.format(self.name)
+
+    @property
+    def parked_token(self):
+        """
+        The token for the parked upload, or None if there isn't an accepted upload to park.  The
+        upload is parked the first time this is read, so files are only copied when the form is
+        actually shown again
+        """
+        if self._parked_token is None and self.park_uploads and self.file is not None \
+                and self.value is not None and not self.error:
+            self._parked_token = parkedupload.get_parking_store().park(self.file.stream,
+                                                                       self.filename, self.name)
+
+        return self._parked_token
+
+    @property
+    def chunked_upload_url(self):
+        return chunkedupload.get_upload_url()
+
+    @property
+    def chunk_size(self):
+        return chunkedupload.get_chunk_size()
+
+    def get_uploaded_file(self):
+        """
+        Get the uploaded file from the submission.  In chunked mode, the submitted token is
+        resolved to the assembled upload, falling back to a normal upload if there's no token.
+        If uploads are parked and no new file was selected, the parked upload is used
+
+        :return: A FileStorage, or None if the field wasn't submitted
+        """
+        submission = self.get_submission()
+        if self.chunked:
+            token = submission.data.get(self.token_name)
+            if token:
+                upload = chunkedupload.get_chunk_store().claim(token)
+                if upload is None:
+                    self.error = 'Upload not found.  Please select your file again'
+                else:
+                    self.upload_token = token
+                    self._claimed_upload = upload
+
+                return upload
+
+        upload = submission.files.get(self.name)
+        if self.park_uploads and (upload is None or not upload.filename):
+            # No new file has been selected, so use the one from the previous submission
+            token = submission.data.get(self.parked_token_name)
+            if token:
+                parked = parkedupload.get_parking_store().open(token, self.name)
+                if parked is None:
+                    self.error = 'Your earlier upload has expired.  Please select your file again'
+                else:
+                    self._parked_token = token
+                    self._claimed_upload = parked
+                    return parked
+
+        return upload
 
     def convert_value(self):
-        if self.name in request.files:
-            self.file = request.files[self.name]
+        upload = self.get_uploaded_file()
+        if upload is not None:
+            self.file = upload
             self.filename = self.file.filename
             if self.filename:
-                self.value = self.file.read()
+                if self.sink is None and self.max_bytes is None and self.hash_algorithm is None:
+                    self.value = self.file.read()
+                else:
+                    self.copy_to_sink()
+
+                self.check_content_index()
+
                 if not self.disable_submitted_warning:
                     self.submitted = True
             else:
@@ -581,18 +742,164 @@ class FileUploadField(form.Field):
                 self.filename = None
                 self.value = None
 
+        self.release_claimed_upload()
+
+    def needs_upload_stream(self):
+        """True if the uploaded stream is still used after the value has been converted"""
+        # Uploads that came from the parking store don't need parking again
+        return self.park_uploads and self._parked_token is None
+
+    def release_claimed_upload(self):
+        """
+        Close a chunked or parked upload once it has been converted.  A chunked upload's file
+        has already been removed from the chunk store, and a parked one stays parked.  If the
+        stream is still needed (i.e. to park it, or to decode a header only image), it's closed
+        at the end of the request instead.  Outside of a request it's left open, and is closed
+        when the field is discarded
+        """
+        upload = self._claimed_upload
+        if upload is None:
+            return
+
+        self._claimed_upload = None
+        if not self.needs_upload_stream() or self.value is None:
+            upload.close()
+        elif has_request_context():
+            @after_this_request
+            def close_upload(response):
+                upload.close()
+                return response
+
+    def copy_to_sink(self):
+        """Copy the upload into the sink, enforcing max_bytes and calculating the digest"""
+        sink = self.sink if self.sink is not None else uploads.MemorySink()
+        try:
+            self.value, self.size, self.digest = uploads.copy_upload(
+                self.file.stream, sink, self.filename, max_bytes=self.max_bytes,
+                hash_algorithm=self.hash_algorithm
+            )
+        except exceptions.FileTooLarge:
+            self.error = 'File is too large.  The maximum size is {}'.format(
+                uploads.format_size(self.max_bytes)
+            )
+            self.value = None
+            self.file = None
+            self.filename = None
+
+    def check_content_index(self):
+        """Look up the digest of the upload in the content index"""
+        if self.content_index is not None and self.digest is not None:
+            self.known_content = self.content_index.get(self.digest)
+
+    def remember_content(self, value=True):
+        """
+        Add the upload to the content index, so that future uploads of the same file are marked
+        as duplicates
+
+        :param value: What to store against the digest, i.e. where the application stored the
+                      file.  This becomes known_content for the duplicates
+        """
+        if self.content_index is None or self.digest is None:
+            raise ValueError('No content index or digest for {}'.format(self.name))
+
+        self.content_index.add(self.digest, value)
+
 
 class ImageUploadField(FileUploadField):
-    def __init__(self, name, accept='image/*', min_image_width=None, min_image_height=None, max_image_width=None, max_image_height=None, **kwargs):
+    template = 'advanced/image_upload.html'
+    heavy = True
+
+    def __init__(self, name, accept='image/*', min_image_width=None, min_image_height=None, max_image_width=None, max_image_height=None,
+                 header_only=False, derivatives=None, client_resize=False, client_resize_quality=0.9,
+                 **kwargs):
+        """
+        :param header_only: If True, the upload isn't read into memory.  The image is checked
+                            using just its header, read directly from the uploaded file, and
+                            value is an image that is only decoded when its pixel data is
+                            used.  raw_image_data reads the file each time it's accessed.  The
+                            image must be used before the end of the request, while the upload
+                            is still open.  Outside of a request (i.e. processing a Submission
+                            in a batch job) the upload stays open as long as the field
+        :param derivatives: List of imagederivatives.Derivative to make from each accepted
+                            image.  They are made from the decoded image on the derivative
+                            executor, and derivative_future is set to a future whose result is
+                            a dictionary of derivative name => encoded bytes
+        :param client_resize: If True, browsers shrink JPEG, PNG and WebP images that are larger
+                              than max_image_width or max_image_height before uploading them.
+                              The size is still checked here, as not all browsers can do this
+        :param client_resize_quality: The quality (0 to 1) used by the browser to re-encode
+                                      lossy images
+        """
         super(ImageUploadField, self).__init__(name, accept, value=None, **kwargs)
 
         self.min_image_width = min_image_width
         self.min_image_height = min_image_height
         self.max_image_width = max_image_width
         self.max_image_height = max_image_height
+        self.header_only = header_only
         self.raw_image_data = None
+        self.derivatives = derivatives
+        self.derivative_future = None
+        self.client_resize = client_resize
+        self.client_resize_quality = client_resize_quality
+
+    @property
+    def raw_image_data(self):
+        if self._raw_image_data is None and self.header_only and self.value is not None:
+            # Read the bytes on demand rather than holding on to a copy
+            stream = self.file.stream
+            position = stream.tell()
+            try:
+                stream.seek(0)
+                return stream.read()
+            finally:
+                stream.seek(position)
+
+        return self._raw_image_data
+
+    @raw_image_data.setter
+    def raw_image_data(self, val):
+        self._raw_image_data = val
+
+    def check_image_size(self, width, height):
+        """Set the error if the image dimensions are outside of the allowed range"""
+        if (self.min_image_width is not None and width < self.min_image_width) or \
+                (self.max_image_width is not None and width > self.max_image_width) or \
+                (self.min_image_height is not None and height < self.min_image_height) or \
+                (self.max_image_height is not None and height > self.max_image_height):
+
+            if self.min_image_width is not None and self.min_image_width == self.max_image_width and self.min_image_height is not None and self.min_image_height == self.max_image_height:
+                self.error = 'Image must be %s x %s pixels' % (self.min_image_width, self.min_image_height)
+            else:
+                self.error = ''
+
+                if self.min_image_width is not None:
+                    if self.max_image_width is not None:
+                        if self.min_image_width == self.max_image_width:
+                            self.error += 'Image width must be %s pixels. '
+                        else:
+                            self.error += 'Image width must be between %s and %s pixels. ' % (self.min_image_width, self.max_image_width)
+                    else:
+                        self.error += 'Image must be at least %s pixels wide. ' % self.min_image_width
+                elif self.max_image_width is not None:
+                    self.error += 'Image width must be at most %s pixels wide. ' % self.max_image_width
+
+                if self.min_image_height is not None:
+                    if self.max_image_height is not None:
+                        if self.min_image_height == self.max_image_height:
+                            self.error += 'Image height must be %s pixels.'
+                        else:
+                            self.error += 'Image height must be between %s and %s pixels.' % (self.min_image_height, self.max_image_height)
+                    else:
+                        self.error += 'Image must be at least %s pixels tall.' % self.min_image_height
+                elif self.max_image_height is not None:
+                    self.error += 'Image height must be at most %s pixels tall.' % self.max_image_height
 
     def convert_value(self):
+        if self.header_only:
+            self.convert_value_from_header()
+            return
+
         # This will get the file bytes and filename
         super(ImageUploadField, self).convert_value()
 
@@ -602,10 +909,13 @@ class ImageUploadField(FileUploadField):
         if not self.value:
             return
 
-        # Now time to process the image
-        self.raw_image_data = self.value
+        # Now time to process the image.  Sinks other than memory give a file or a path
+        if isinstance(self.value, bytes):
+            self.raw_image_data = self.value
+            stream = io.BytesIO(self.value)
+        else:
+            stream = self.value
 
-        stream = io.BytesIO(self.value)
         image = None
         try:
             image = Image.open(stream)
@@ -613,48 +923,85 @@ class ImageUploadField(FileUploadField):
             self.error = 'Invalid image file'
 
         if not self.error:
-            width = image.size[0]
-            height = image.size[1]
+            self.check_image_size(image.size[0], image.size[1])
 
-            if (self.min_image_width is not None and width < self.min_image_width) or \
-                    (self.max_image_width is not None and width > self.max_image_width) or \
-                    (self.min_image_height is not None and height < self.min_image_height) or \
-                    (self.max_image_height is not None and height > self.max_image_height):
+        if self.error:
+            self.value = None
+            self.file = None
+            self.filename = None
+            self.raw_image_data = None
+            self.known_content = None
+        else:
+            self.value = image
+            self.submit_derivatives()
 
-                if self.min_image_width is not None and self.min_image_width == self.max_image_width and self.min_image_height is not None and self.min_image_height == self.max_image_height:
-                    self.error = 'Image must be %s x %s pixels' % (self.min_image_width, self.min_image_height)
-                else:
-                    self.error = ''
-
-                    if self.min_image_width is not None:
-                        if self.max_image_width is not None:
-                            if self.min_image_width == self.max_image_width:
-                                self.error += 'Image width must be %s pixels. '
-                            else:
-                                self.error += 'Image width must be between %s and %s pixels. ' % (self.min_image_width, self.max_image_width)
-                        else:
-                            self.error += 'Image must be at least %s pixels wide. ' % self.min_image_width
-                    elif self.max_image_width is not None:
-                        self.error += 'Image width must be at most %s pixels wide. ' % self.max_image_width
-
-                    if self.min_image_height is not None:
-                        if self.max_image_height is not None:
-                            if self.min_image_height == self.max_image_height:
-                                self.error += 'Image height must be %s pixels.'
-                            else:
-                                self.error += 'Image height must be between %s and %s pixels.' % (self.min_image_height, self.max_image_height)
-                        else:
-                            self.error += 'Image must be at least %s pixels tall.' % self.min_image_height
-                    elif self.max_image_height is not None:
-                        self.error += 'Image height must be at most %s pixels tall.' % self.max_image_height
+    def convert_value_from_header(self):
+        """
+        Check the image without reading the whole upload.  Pillow only reads the header when an
+        image is opened, and the uploaded file is already spooled to disk by werkzeug if it's
+        large, so this uses very little memory however big the image is
+        """
+        from PIL import Image
+
+        upload = self.get_uploaded_file()
+        if upload is None:
+            return
+
+        self.file = upload
+        self.filename = self.file.filename
+        if not self.filename:
+            self.file = None
+            self.filename = None
+            self.value = None
+            self.release_claimed_upload()
+            return
+
+        if not self.disable_submitted_warning:
+            self.submitted = True
+
+        image = None
+        if self.max_bytes is not None:
+            size = uploads.get_stream_size(self.file.stream)
+            if size is not None and size > self.max_bytes:
+                self.error = 'File is too large.  The maximum size is {}'.format(
+                    uploads.format_size(self.max_bytes)
+                )
+
+        if not self.error:
+            try:
+                image = Image.open(self.file.stream)
+            except IOError:
+                self.error = 'Invalid image file'
+
+        if not self.error:
+            self.check_image_size(image.size[0], image.size[1])
 
         if self.error:
             self.value = None
             self.file = None
             self.filename = None
-            self.raw_image_data = None
         else:
             self.value = image
+            if self.hash_algorithm is not None:
+                self.digest = uploads.hash_stream(self.file.stream, self.hash_algorithm)
+                self.check_content_index()
+            self.submit_derivatives()
+
+        self.release_claimed_upload()
+
+    def needs_upload_stream(self):
+        # In header only mode the image is read from the upload when it's used
+        return super().needs_upload_stream() or self.header_only
+
+    def submit_derivatives(self):
+        """Start making the derivatives of the accepted image, if there are any"""
+        if not self.derivatives:
+            return
+
+        # Decode the image here, once, so that the pool and the view can share the pixel data
+        # without either of them reading from the upload
+        self.value.load()
+        self.derivative_future = imagederivatives.submit_derivatives(self.value, self.derivatives)
 
 
 class MultiCheckboxField(form.Field):
@@ -667,6 +1014,8 @@ class MultiCheckboxField(form.Field):
     When reading form data, the original objects will be copied into a new list, with each
     object that had its box ticked being present in the list.
     """
+    template = 'advanced/multicheckbox.html'
+
     def __init__(self, name, values, value=None, **kwargs):
         if value is None:
             value = []
@@ -677,17 +1026,19 @@ class MultiCheckboxField(form.Field):
         super().__init__(name, allow_missing=True, value=value, **kwargs)
 
         self.values = values
-        self._checked_select_values = [v.select_value for v in self.value]
-    
-    def render(self):
-        return env.get_template('advanced/multicheckbox.html').render(field=self)
+        self._checked_select_values = options.make_value_set(v.select_value for v in self.value)
+
+    def is_checked(self, select_value):
+        return options.value_in(select_value, self._checked_select_values)
 
     def extract_value(self, data):
-        self._checked_select_values = data.getlist(self.name)
-        self.value = [v for v in self.values if v.select_value in self._checked_select_values]
+        self._checked_select_values = options.make_value_set(data.getlist(self.name))
+        self.value = [v for v in self.values if self.is_checked(v.select_value)]
 
 
 class SubmitCancelButton(basicfields.SubmitButton):
+    template = 'advanced/submit_cancel.html'
+
     def __init__(self, name, cancel_url, value=None, cancel_text='Cancel', css_class='btn-primary',
                  cancel_css_class='btn-danger', render_after_sections=True, **kwargs):
         self.cancel_url = cancel_url
@@ -697,9 +1048,6 @@ class SubmitCancelButton(basicfields.SubmitButton):
         super().__init__(name, value=value, css_class=css_class,
                          render_after_sections=render_after_sections, **kwargs)
 
-    def render(self):
-        return env.get_template('advanced/submit_cancel.html').render(field=self)
-
 
 class CardNumberField(basicfields.TextField):
     def __init__(self, name, **kwargs):
@@ -720,8 +1068,21 @@ class RecaptchaField(form.Field):
     :param name: The form name - really only used for the label
     :param site_key: The site key for the recaptcha (see ReCaptcha documentation)
     :param secret_key: The secret key for the recaptcha
+    :param verifier: The recaptcha.RecaptchaVerifier used to check the response.  Defaults to
+                     the shared verifier (see recaptcha.init_recaptcha_verifier())
+    :param remember_for: If set, a completed recaptcha is remembered in the session for this
+                         many seconds, so if the form is shown again because of another error
+                         the recaptcha isn't displayed or checked again.  The form must have a
+                         unique form_name.  Call forget_verification() once the form has been
+                         accepted.  With flask's default cookie session the marker is stored by
+                         the browser, so forgetting it can't stop a client re-sending an older
+                         cookie that still has it.  Until it expires, one completed recaptcha
+                         can be replayed that way, so keep remember_for short, or use a server
+                         side session if that matters
     """
-    def __init__(self, name, site_key, secret_key, **kwargs):
+    template = 'advanced/recaptcha.html'
+
+    def __init__(self, name, site_key, secret_key, verifier=None, remember_for=None, **kwargs):
         if 'value' in kwargs:
             raise ValueError('Can\'t set value of RecaptchaField')
 
@@ -732,34 +1093,49 @@ class RecaptchaField(form.Field):
         
         self.site_key = site_key
         self.secret_key = secret_key
+        self.verifier = verifier
+        self.remember_for = remember_for
     
-    def render(self):
-        return env.get_template('advanced/recaptcha.html').render(field=self)
-    
+    def get_verifier(self):
+        return self.verifier if self.verifier is not None else recaptcha.get_recaptcha_verifier()
+
+    @property
+    def form_name(self):
+        """The name of the form, which the remembered verification is bound to"""
+        form_name = self.form.form_name if self.form else ''
+        if self.remember_for and not form_name:
+            # Otherwise every unnamed form would share the same marker
+            raise ValueError('RecaptchaField {} has remember_for set, so it must be in a form with '
+                             'a form_name'.format(self.name))
+
+        return form_name
+
+    @property
+    def already_verified(self):
+        """True if the recaptcha for this form has been completed within remember_for"""
+        return bool(self.remember_for) and recaptcha.is_verified(self.form_name, self.remember_for)
+
+    def forget_verification(self):
+        """Require the recaptcha to be completed again the next time the form is submitted"""
+        recaptcha.forget_verification(self.form_name)
+
     def extract_value(self, data):
+        if self.already_verified:
+            self.value = True
+            return
+
         recaptcha_response = data.get('g-recaptcha-response')
         if recaptcha_response:
-            url = 'https://www.google.com/recaptcha/api/siteverify'
-            data = {
-                'secret': self.secret_key,
-                'response': recaptcha_response,
-                'remoteip': request.remote_addr
-            }
-
-            r = requests.post(url, data)
-
-            if r.status_code != 200:
-                log.debug('Recaptcha failed with response code {}'.format(r.status_code))
-            else:
-                # log.debug('Recaptcha response: {}'.format(r.text))
-                resp = r.json()
-                success = resp['success']
-                error_codes = resp.get('error-codes')
-                if success:
+            try:
+                if self.get_verifier().verify(self.secret_key, recaptcha_response,
+                                              self.get_submission().remote_addr):
                     # Passed the recaptcha
                     self.value = True
-                else:
-                    log.debug('Recaptcha failed with error codes: {}'.format(', '.join(error_codes)))
+                    if self.remember_for:
+                        recaptcha.remember_verification(self.form_name)
+            except exceptions.RecaptchaUnavailable as e:
+                log.warning('Unable to check recaptcha: {}'.format(e))
+                self.error = 'Unable to check the recaptcha.  Please try again'
 
 
 class GetaddressPostcodeField(PostcodeField):
@@ -796,14 +1172,16 @@ class GetaddressPostcodeField(PostcodeField):
         self.sort_addresses = sort_addresses
         self.inline_button = inline_button
 
-    def render(self):
+    def get_template_name(self):
         if self.readonly:
-            return super().render()
+            return super().get_template_name()
 
-        return env.get_template('advanced/getaddress_postcode_field.html').render(field=self)
+        return 'advanced/getaddress_postcode_field.html'
 
 
 class MultiSubmitButton(form.Field):
+    template = 'advanced/multi_submit.html'
+
     def __init__(self, name, values, css_classes=None, render_after_sections=True, **kwargs):
         self.values = values
         self.css_classes = []
@@ -815,7 +1193,3 @@ class MultiSubmitButton(form.Field):
 
         super().__init__(name, value='', noclear=True, render_after_sections=render_after_sections,
                          allow_missing=True, **kwargs)
-
-    def render(self):
-        return env.get_template('advanced/multi_submit.html').render(field=self)
-
@@ -6,7 +6,7 @@ import logging
 from decimal import Decimal, InvalidOperation
 
 from . import form
-from .env import env
+from . import options
 from . import validate
 
 __author__ = 'Stephen Brown (Little Fish Solutions LTD)'
@@ -15,6 +15,8 @@ log = logging.getLogger(__name__)
 
 
 class TextField(form.Field):
+    template = 'ef_basic_input.html'
+
     def __init__(self, name, type='text', placeholder=None, **kwargs):
         """
         :param name: The name of the field (the name field in the generated input)
@@ -26,9 +28,6 @@ class TextField(form.Field):
         self.type = type
         self.placeholder = placeholder
 
-    def render(self):
-        return env.get_template('ef_basic_input.html').render(field=self)
-
 
 class PasswordField(TextField):
     def __init__(self, name, **kwargs):
@@ -42,6 +41,8 @@ class PasswordField(TextField):
 
 
 class TextAreaField(form.Field):
+    template = 'basic/text_area.html'
+
     def __init__(self, name, rows=5, placeholder=None, maxlength=None, **kwargs):
         super(TextAreaField, self).__init__(name, **kwargs)
 
@@ -49,9 +50,6 @@ class TextAreaField(form.Field):
         self.rows = rows
         self.maxlength = maxlength
 
-    def render(self):
-        return env.get_template('basic/text_area.html').render(field=self)
-
 
 class IntegerField(TextField):
     def __init__(self, name, type='number', min_value=None, max_value=None, step=None, **kwargs):
@@ -104,6 +102,16 @@ class DecimalField(TextField):
 
 
 class SelectField(form.Field):
+    template = 'basic/select.html'
+
+    # The attributes of each key pair holding the submitted value and the option text
+    option_value_attribute = 'select_value'
+    option_name_attribute = 'select_name'
+
+    # If True, an option is selected if its value equals the field value, as well as when the
+    # option itself is the field value
+    select_by_option_value = True
+
     def __init__(self, name, key_pairs, empty_option=False, empty_option_name='', button_link_url=None,
                  button_link_text=None, **kwargs):
 
@@ -115,16 +123,93 @@ class SelectField(form.Field):
         self.button_link_url = button_link_url
         self.button_link_text = button_link_text
 
-    def render(self):
-        return env.get_template('basic/select.html').render(field=self)
+    @property
+    def key_pairs(self):
+        return self._key_pairs
+
+    @key_pairs.setter
+    def key_pairs(self, val):
+        # Prerendered options are only valid for the key pairs they were built from.  If you
+        # modify the list in place after rendering, assign it again to rebuild them
+        self._key_pairs = val
+        self._option_lists = {}
+
+    def get_option_context(self, option_format):
+        """The values from this field needed to render options in the given format"""
+        context = {
+            'field_name': self.name,
+            'field_id': self.id,
+            'readonly': ' readonly' if self.readonly else ''
+        }
+        return {name: context[name] for name in option_format.context_attributes}
+
+    def get_option_list(self, format_name='select'):
+        """
+        Get the prerendered options for this field, along with a list of the key pairs that
+        they were built from.  Returns (None, None) if the key pairs can't be iterated over more
+        than once (i.e. a generator or async iterable)
+
+        :param format_name: The name of the option format to render with
+        """
+        if not options.is_reiterable(self.key_pairs):
+            return None, None
+
+        option_format = options.get_option_format(format_name)
+        context = self.get_option_context(option_format)
+        key = (format_name, tuple(context.items()))
+
+        cached = self._option_lists.get(key)
+        if cached is None:
+            key_pairs = list(self.key_pairs)
+            items = tuple(
+                (getattr(key_pair, self.option_value_attribute),
+                 getattr(key_pair, self.option_name_attribute))
+                for key_pair in key_pairs
+            )
+            option_list = options.option_list_cache.get_option_list(option_format, items, context)
+            cached = (option_list, key_pairs)
+            self._option_lists[key] = cached
+
+        return cached
+
+    def get_selected_option_indices(self, option_list, key_pairs):
+        """The indices of the options that match the current value"""
+        selected = set()
+        if self.select_by_option_value:
+            selected.update(option_list.find(self.value))
+
+        # The value may be one of the key pairs
+        option_value = getattr(self.value, self.option_value_attribute, options.MISSING)
+        if option_value is not options.MISSING:
+            selected.update(i for i in option_list.find(option_value) if key_pairs[i] == self.value)
+
+        return selected
+
+    def render_options(self, format_name='select'):
+        """
+        Render the options from the prerendered html, with the selected options marked.
+        Returns None if the options can't be prerendered, in which case the template should
+        render them itself
+
+        :param format_name: The name of the option format to render with
+        """
+        option_list, key_pairs = self.get_option_list(format_name)
+        if option_list is None:
+            return None
+
+        return option_list.render(self.get_selected_option_indices(option_list, key_pairs))
 
     def convert_value(self):
         if self.value:
-            valid = False
-            for key_pair in self.key_pairs:
-                if self.value == key_pair.select_value:
-                    valid = True
-                    break
+            option_list, key_pairs = self.get_option_list()
+            if option_list is not None:
+                valid = len(option_list.find(self.value)) > 0
+            else:
+                valid = False
+                for key_pair in self.key_pairs:
+                    if self.value == key_pair.select_value:
+                        valid = True
+                        break
 
             if not valid:
                 self.error = 'Invalid selection'
@@ -132,21 +217,19 @@ class SelectField(form.Field):
 
 
 class RadiosField(SelectField):
+    template = 'basic/radios.html'
+
     def __init__(self, name, key_pairs, empty_option=False, empty_option_name='(none)', **kwargs):
 
         super().__init__(name, key_pairs, empty_option, empty_option_name, allow_missing=True, **kwargs)
 
-    def render(self):
-        return env.get_template('basic/radios.html').render(field=self)
-
 
 class BooleanCheckbox(form.Field):
+    template = 'basic/checkbox.html'
+
     def __init__(self, name, default=False, **kwargs):
         super(BooleanCheckbox, self).__init__(name, required=False, allow_missing=True, value=default, **kwargs)
 
-    def render(self):
-        return env.get_template('basic/checkbox.html').render(field=self)
-
     def convert_value(self):
         if self.value is not None:
             self.value = True
@@ -155,6 +238,8 @@ class BooleanCheckbox(form.Field):
 
 
 class SubmitButton(form.Field):
+    template = 'basic/submit.html'
+
     def __init__(self, name, value=None, css_class='btn-primary', render_after_sections=True, **kwargs):
         if value is None:
             value = form.convert_name_to_label(name)
@@ -165,18 +250,13 @@ class SubmitButton(form.Field):
                                            render_after_sections=render_after_sections,
                                            allow_missing=True, allow_duplicates=True, **kwargs)
 
-    def render(self):
-        return env.get_template('basic/submit.html').render(field=self)
-
 
 class HiddenField(form.Field):
+    template = 'basic/hidden_input.html'
+
     def __init__(self, name, value, **kwargs):
         """
         :param name: The name of the field (the name field in the generated input)
         :param value: The value of the hidden field
         """
         super(HiddenField, self).__init__(name, value=value, **kwargs)
-
-    def render(self):
-        return env.get_template('basic/hidden_input.html').render(field=self)
-
@@ -0,0 +1,410 @@
+"""
+Resumable chunked uploads for FileUploadField and ImageUploadField.  The browser sends the file
+in numbered chunks to a small blueprint, which stores them on disk and joins them together
+once they have all arrived.  The form then only submits a token, which the field resolves to
+the assembled file.  If the connection drops, the browser asks which chunks have been received
+and carries on from there.
+
+To use, register the blueprint when creating the app, with a function that decides who can
+upload:
+
+    chunkedupload.init_chunked_uploads(app, '/var/tmp/uploads',
+                                       check_access=lambda: current_user.is_authenticated)
+
+and pass chunked=True to the upload fields
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+
+from flask import Blueprint, abort, jsonify, request, url_for
+from werkzeug.datastructures import FileStorage
+
+from . import exceptions
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+BLUEPRINT_NAME = 'easyforms_chunked_upload'
+
+# Upload ids are generated by secrets.token_urlsafe, anything else is rejected
+_upload_id_regex = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+# Assembled uploads are renamed to this, followed by the upload id, when a field claims them
+_claimed_prefix = 'claimed-'
+
+# The store used by the blueprint and the fields, and the size of chunk the browser sends
+_chunk_store = None
+_chunk_size = 8 * 1024 * 1024
+
+
+class ChunkStore(object):
+    """
+    Keeps the chunks of each upload in its own directory, and assembles them into a single file
+
+    :param directory: The directory to keep uploads in
+    :param max_age: Uploads older than this many seconds are deleted by cleanup()
+    :param max_pending_bytes: The total size of the uploads that can be in the store at once.
+                              start() raises ChunkStoreFull once this is reached.  None for no
+                              limit
+    """
+    def __init__(self, directory, max_age=24 * 60 * 60, max_pending_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_pending_bytes = max_pending_bytes
+        self._start_lock = threading.Lock()
+        self._last_cleanup = 0
+        self._cleanup_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_path(self, upload_id, *parts):
+        if not upload_id or not _upload_id_regex.match(upload_id):
+            raise ValueError('Invalid upload id')
+
+        return os.path.join(self.directory, upload_id, *parts)
+
+    def _get_metadata(self, upload_id):
+        try:
+            with open(self._get_path(upload_id, 'upload.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def start(self, filename, size, chunk_size):
+        """
+        Start a new upload
+
+        :param filename: The name of the file being uploaded
+        :param size: The size of the file in bytes
+        :param chunk_size: The size of each chunk, except the last one which has the remainder
+        :return: The id of the upload
+        """
+        upload_id = secrets.token_urlsafe(32)
+
+        # The lock only covers this process.  Other processes sharing the directory can go over
+        # the limit by the size of the uploads they are starting at the same time
+        with self._start_lock:
+            if self.max_pending_bytes is not None:
+                pending_bytes = self.get_pending_bytes()
+                if pending_bytes + size > self.max_pending_bytes:
+                    raise exceptions.ChunkStoreFull(pending_bytes)
+
+            os.makedirs(self._get_path(upload_id))
+            with open(self._get_path(upload_id, 'upload.json'), 'w') as f:
+                json.dump({
+                    'filename': filename,
+                    'size': size,
+                    'chunk_size': chunk_size,
+                    'chunk_count': max(1, math.ceil(size / chunk_size))
+                }, f)
+
+        return upload_id
+
+    def get_pending_bytes(self):
+        """Get the total declared size of the uploads in the store"""
+        pending_bytes = 0
+        for name in os.listdir(self.directory):
+            if _upload_id_regex.match(name):
+                metadata = self._get_metadata(name)
+                if metadata is not None:
+                    pending_bytes += metadata['size']
+
+        return pending_bytes
+
+    def exists(self, upload_id):
+        try:
+            return self._get_metadata(upload_id) is not None
+        except ValueError:
+            return False
+
+    def save_chunk(self, upload_id, index, data):
+        """
+        Store a chunk.  Chunks can be sent more than once, the last one wins.  Raises
+        FileTooLarge if the chunk is longer than it should be for the size given to start(), so
+        nothing beyond the declared size is ever written
+
+        :param upload_id: The id of the upload
+        :param index: The number of the chunk, starting at 0
+        :param data: The bytes of the chunk
+        """
+        metadata = self._get_metadata(upload_id)
+        if metadata is None:
+            raise ValueError('Unknown upload')
+        if index < 0 or index >= metadata['chunk_count']:
+            raise ValueError('Invalid chunk number')
+
+        chunk_size = metadata['chunk_size']
+        if len(data) > min(chunk_size, metadata['size'] - index * chunk_size):
+            raise exceptions.FileTooLarge(len(data))
+
+        path = self._get_path(upload_id, 'chunk-{:06d}'.format(index))
+        # Write to a temporary file first so that a partial chunk is never seen
+        with open(path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+
+    def get_received_chunks(self, upload_id):
+        """Get the numbers of the chunks that have been stored"""
+        return sorted(
+            int(name[6:]) for name in os.listdir(self._get_path(upload_id))
+            if name.startswith('chunk-') and not name.endswith('.part')
+        )
+
+    def assemble(self, upload_id):
+        """
+        Join the chunks together.  Raises ValueError if any are missing or the size is wrong
+
+        :return: The path of the assembled file
+        """
+        metadata = self._get_metadata(upload_id)
+        if metadata is None:
+            raise ValueError('Unknown upload')
+
+        path = self._get_path(upload_id, 'file')
+        if os.path.exists(path):
+            return path
+
+        received = self.get_received_chunks(upload_id)
+        if received != list(range(metadata['chunk_count'])):
+            raise ValueError('Upload is missing chunks')
+
+        with open(path + '.part', 'wb') as output:
+            for index in received:
+                with open(self._get_path(upload_id, 'chunk-{:06d}'.format(index)), 'rb') as f:
+                    shutil.copyfileobj(f, output)
+
+            size = output.tell()
+
+        if size != metadata['size']:
+            os.remove(path + '.part')
+            raise ValueError('Upload is the wrong size')
+
+        os.replace(path + '.part', path)
+
+        for index in received:
+            os.remove(self._get_path(upload_id, 'chunk-{:06d}'.format(index)))
+
+        return path
+
+    def claim(self, upload_id):
+        """
+        Take an assembled upload out of the store, so that its token can't be used again.  The
+        file is deleted as soon as it has been opened, so it's gone once the stream is closed
+
+        :return: The upload as a FileStorage, like the ones in request.files, or None if the
+                 upload doesn't exist, hasn't been assembled or has already been claimed
+        """
+        try:
+            metadata = self._get_metadata(upload_id)
+            path = self._get_path(upload_id, 'file')
+        except ValueError:
+            return None
+
+        if metadata is None:
+            return None
+
+        # Renaming is atomic, so only one submission can claim the upload
+        claimed_path = os.path.join(self.directory, _claimed_prefix + upload_id)
+        try:
+            os.replace(path, claimed_path)
+        except OSError:
+            return None
+
+        self.delete(upload_id)
+        stream = open(claimed_path, 'rb')
+        try:
+            os.remove(claimed_path)
+        except OSError:
+            # Can't remove open files on some platforms - cleanup() will get it later
+            pass
+
+        return FileStorage(stream, filename=metadata['filename'])
+
+    def delete(self, upload_id):
+        shutil.rmtree(self._get_path(upload_id), ignore_errors=True)
+
+    def cleanup(self):
+        """Delete any uploads older than max_age"""
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if _upload_id_regex.match(name) and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                elif name.startswith(_claimed_prefix) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                log.warning('Failed to remove old upload {}'.format(path))
+
+    def cleanup_if_due(self):
+        """Clean up at most ten times per max_age, rather than every time an upload starts"""
+        now = time.time()
+        if now - self._last_cleanup < self.max_age / 10:
+            return
+
+        with self._cleanup_lock:
+            if now - self._last_cleanup < self.max_age / 10:
+                return
+            self._last_cleanup = now
+
+        self.cleanup()
+
+
+def create_blueprint(chunk_store, check_access, max_chunk_bytes=8 * 1024 * 1024,
+                     max_upload_bytes=100 * 1024 * 1024):
+    """
+    Create the blueprint that receives the chunks.  Each upload must be sent in chunks of
+    max_chunk_bytes (except the last one)
+
+    :param chunk_store: The ChunkStore to keep the uploads in
+    :param check_access: Function called with no arguments before every request to the
+                         blueprint.  If it returns a false value the request is refused with a
+                         403.  It can also abort() or redirect itself
+    :param max_chunk_bytes: The largest chunk that will be accepted
+    :param max_upload_bytes: The largest upload that will be accepted
+    """
+    blueprint = Blueprint(BLUEPRINT_NAME, __name__)
+
+    @blueprint.before_request
+    def before_request():
+        if not check_access():
+            abort(403)
+
+    def check_upload_id(upload_id):
+        if not chunk_store.exists(upload_id):
+            abort(404)
+
+    @blueprint.route('/', methods=['GET'])
+    def index():
+        return jsonify(chunk_size=max_chunk_bytes, max_upload_bytes=max_upload_bytes)
+
+    @blueprint.route('/start', methods=['POST'])
+    def start():
+        chunk_store.cleanup_if_due()
+
+        data = request.get_json(silent=True) or {}
+        try:
+            filename = str(data['filename'])
+            size = int(data['size'])
+            chunk_count = int(data['chunk_count'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        if size > max_upload_bytes:
+            abort(413)
+
+        # Fixing the number of chunks stops clients creating huge numbers of tiny ones
+        if size < 0 or chunk_count != max(1, math.ceil(size / max_chunk_bytes)):
+            abort(400)
+
+        try:
+            upload_id = chunk_store.start(filename, size, max_chunk_bytes)
+        except exceptions.ChunkStoreFull:
+            log.warning('Refusing chunked upload of {} bytes - the chunk store is full'.format(
+                size
+            ))
+            abort(503)
+
+        return jsonify(upload_id=upload_id)
+
+    @blueprint.route('/<upload_id>', methods=['GET'])
+    def status(upload_id):
+        check_upload_id(upload_id)
+        return jsonify(received=chunk_store.get_received_chunks(upload_id))
+
+    @blueprint.route('/<upload_id>/<int:index>', methods=['PUT'])
+    def chunk(upload_id, index):
+        check_upload_id(upload_id)
+
+        data = request.stream.read(max_chunk_bytes + 1)
+        if len(data) > max_chunk_bytes:
+            abort(413)
+
+        try:
+            chunk_store.save_chunk(upload_id, index, data)
+        except exceptions.FileTooLarge:
+            abort(413)
+        except ValueError:
+            abort(400)
+
+        return jsonify(received=index)
+
+    @blueprint.route('/<upload_id>/complete', methods=['POST'])
+    def complete(upload_id):
+        check_upload_id(upload_id)
+
+        try:
+            chunk_store.assemble(upload_id)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+
+        return jsonify(token=upload_id)
+
+    return blueprint
+
+
+def init_chunked_uploads(app, directory, check_access, url_prefix='/easyforms/upload',
+                         max_age=24 * 60 * 60, max_chunk_bytes=8 * 1024 * 1024,
+                         max_upload_bytes=100 * 1024 * 1024, max_pending_bytes=1024 * 1024 * 1024):
+    """
+    Enable chunked uploads.  Call this when creating the app
+
+    :param app: The flask app
+    :param directory: Where to keep the uploads.  Needs enough space for max_pending_bytes,
+                      plus the largest upload again while it's being assembled
+    :param check_access: Function called with no arguments before every request to the upload
+                         endpoints, i.e. lambda: current_user.is_authenticated.  Requests are
+                         refused with a 403 if it returns a false value.  Pass lambda: True to
+                         let anyone upload
+    :param url_prefix: Where to register the blueprint
+    :param max_age: Uploads older than this many seconds are deleted
+    :param max_chunk_bytes: The largest chunk that will be accepted
+    :param max_upload_bytes: The largest upload that will be accepted.  Larger uploads are
+                             rejected before any chunks are sent.  Fields can have a lower
+                             limit (max_bytes), which is checked once the upload is assembled
+    :param max_pending_bytes: The total size of the uploads that can be in progress, or
+                              waiting for a form to use them, at once.  New uploads are refused
+                              with a 503 once this is reached
+    """
+    global _chunk_size
+
+    chunk_store = ChunkStore(directory, max_age=max_age, max_pending_bytes=max_pending_bytes)
+    set_chunk_store(chunk_store)
+    _chunk_size = max_chunk_bytes
+    app.register_blueprint(create_blueprint(chunk_store, check_access,
+                                            max_chunk_bytes=max_chunk_bytes,
+                                            max_upload_bytes=max_upload_bytes),
+                           url_prefix=url_prefix)
+
+    return chunk_store
+
+
+def set_chunk_store(chunk_store):
+    """Replace the store used by the fields.  Pass None to disable chunked uploads"""
+    global _chunk_store
+
+    _chunk_store = chunk_store
+
+
+def get_chunk_store():
+    if _chunk_store is None:
+        raise exceptions.ChunkedUploadsNotInitialised('Call chunkedupload.init_chunked_uploads() '
+                                                      'to use chunked uploads')
+    return _chunk_store
+
+
+def get_chunk_size():
+    return _chunk_size
+
+
+def get_upload_url():
+    """The url the chunk endpoints are under, ending with a slash"""
+    return url_for(BLUEPRINT_NAME + '.index')
@@ -0,0 +1,107 @@
+"""
+Indexes of uploaded content that the application already has, keyed by the digest of the
+contents.  A FileUploadField with a content index looks up the digest of each upload, so the
+application can skip storing and processing files it has seen before
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+_digest_regex = re.compile(r'^[0-9a-f]{16,128}$')
+
+
+class MemoryContentIndex(object):
+    """
+    Keeps the most recently used digests in memory
+
+    :param max_entries: The number of digests to remember
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        """
+        Get the value stored for a digest
+
+        :return: The value passed to add(), or None if the digest isn't known
+        """
+        with self._lock:
+            value = self._entries.get(digest)
+            if value is not None:
+                self._entries.move_to_end(digest)
+
+            return value
+
+    def add(self, digest, value=True):
+        """
+        Remember a digest
+
+        :param digest: The hex digest of the contents
+        :param value: Anything the application needs to find its copy of the contents, i.e. a
+                      path or a database id.  Must not be None
+        """
+        with self._lock:
+            self._entries[digest] = value
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DirectoryContentIndex(object):
+    """
+    Keeps digests on disk, one small file per digest, so that they are shared between processes
+    and survive restarts.  Values must be serializable as JSON
+
+    :param directory: The directory to keep the index in
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_path(self, digest):
+        if not _digest_regex.match(digest):
+            raise ValueError('Invalid digest: {}'.format(digest))
+
+        # Spread the files over sub directories so that none of them get too big
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, digest):
+        try:
+            with open(self._get_path(digest)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def add(self, digest, value=True):
+        path = self._get_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file and move it into place so readers never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+
+    def remove(self, digest):
+        try:
+            os.remove(self._get_path(digest))
+        except OSError:
+            pass
@@ -3,35 +3,240 @@ Contains fields used to select database models
 """
 
 import logging
+import threading
+import time
 
 from . import basicfields
+from . import options
 
 __author__ = 'Yu Lee Paul (Little Fish Solutions LTD)'
 
 log = logging.getLogger(__name__)
 
+# The cache of options loaded from the database.  None means options are loaded every time
+_option_cache = None
 
-class DbCodeSelectField(basicfields.SelectField):
+
+class DbOption(object):
+    """
+    A snapshot of the parts of a model instance needed to render it as an option.  These are
+    stored in the option cache instead of the instances themselves, so that no instances are
+    shared between database sessions.  Compares equal to anything with the same select_value
+    so that the selected option is found when the field value is a model instance
+    """
+    def __init__(self, instance):
+        self.select_value = instance.select_value
+        self.select_name = instance.select_name
+        self.id = getattr(instance, 'id', None)
+        self.code = getattr(instance, 'code', None)
+
+    def __eq__(self, other):
+        return self.select_value == getattr(other, 'select_value', options.MISSING)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.select_value)
+
+
+class DbOptionCache(object):
+    """
+    Cache of the options for each database model, each of which expires after a time to
+    live.  If listen_for_changes is True, the options for a model are also invalidated whenever
+    an instance of it is inserted, updated or deleted through the ORM.  Bulk updates and
+    changes made outside of this process aren't seen, so the time to live should be set to
+    however long stale options are acceptable for
+
+    :param default_ttl: Time to live in seconds, used for models with no ttl of their own
+    :param listen_for_changes: If True, listen for SQLAlchemy events on each model
+    """
+    def __init__(self, default_ttl=300, listen_for_changes=True):
+        self.default_ttl = default_ttl
+        self.listen_for_changes = listen_for_changes
+        self.hits = 0
+        self.misses = 0
+        self._ttls = {}
+        self._entries = {}
+        self._listening = set()
+        self._lock = threading.Lock()
+
+    def set_ttl(self, db_model, ttl):
+        """
+        Set the time to live for a single model
+
+        :param db_model: The model class
+        :param ttl: Time to live in seconds.  0 disables caching for this model
+        """
+        self._ttls[db_model] = ttl
+        self.invalidate(db_model)
+
+    def get_ttl(self, db_model):
+        return self._ttls.get(db_model, self.default_ttl)
+
+    def get_options(self, db_model, load_function):
+        """
+        Get the cached options for a model, loading them if they are missing or expired
+
+        :param db_model: The model class
+        :param load_function: Function that returns all of the model instances to use as
+                              options, in order
+        """
+        ttl = self.get_ttl(db_model)
+        if not ttl:
+            return load_function()
+
+        if self.listen_for_changes:
+            self._listen(db_model)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(db_model)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        loaded_options = tuple(DbOption(instance) for instance in load_function())
+
+        with self._lock:
+            self._entries[db_model] = (now + ttl, loaded_options)
+
+        return loaded_options
+
+    def invalidate(self, db_model=None):
+        """
+        Remove the cached options for a model, or for all models
+
+        :param db_model: The model class, or None to invalidate everything
+        """
+        with self._lock:
+            if db_model is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(db_model, None)
+
+    def _listen(self, db_model):
+        if db_model in self._listening:
+            return
+
+        with self._lock:
+            if db_model in self._listening:
+                return
+            self._listening.add(db_model)
+
+        try:
+            from sqlalchemy import event
+        except ImportError:
+            log.warning('SQLAlchemy not available - options for {} will only expire after their '
+                        'time to live'.format(db_model.__name__))
+            return
+
+        def invalidate(mapper, connection, target):
+            self.invalidate(db_model)
+
+        for event_name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(db_model, event_name, invalidate, propagate=True)
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+
+def init_option_cache(default_ttl=300, listen_for_changes=True):
+    """
+    Cache the options loaded by DbCodeSelectField and DbIdSelectField when they aren't passed
+    any values.  Call this when initialising the app.  The cache is returned so that per-model
+    time to lives can be set on it
+
+    :param default_ttl: Time to live in seconds for each model's options
+    :param listen_for_changes: If True, invalidate a model's options when SQLAlchemy inserts,
+                               updates or deletes an instance of it
+    """
+    global _option_cache
+
+    _option_cache = DbOptionCache(default_ttl=default_ttl, listen_for_changes=listen_for_changes)
+    return _option_cache
+
+
+def set_option_cache(option_cache):
+    """
+    Replace the option cache, i.e. with a custom implementation.  Pass None to disable caching
+
+    :param option_cache: An object with the same get_options() method as DbOptionCache, or None
+    """
+    global _option_cache
+
+    _option_cache = option_cache
+
+
+def get_option_cache():
+    return _option_cache
+
+
+def load_options(db_model):
+    """Get all of the options for a model, through the option cache if there is one"""
+    def load_function():
+        # This will only work if the model has a name field
+        return db_model.query.order_by(db_model.name).all()
+
+    if _option_cache is None:
+        return load_function()
+
+    return _option_cache.get_options(db_model, load_function)
+
+
+class DbSelectField(basicfields.SelectField):
+    """
+    Base class for select fields that list database models.  If no values are passed in, all
+    instances of the model are used, but they are only loaded when the options are first
+    needed, i.e. when rendering
+    """
+    # The options are loaded lazily, so aren't in the instance attributes until rendered
+    render_cache_attributes = ('key_pairs',)
+
+    def __init__(self, name, db_model, values=None, **kwargs):
+        # Save the database model so that we can load the options when needed
+        self.db_model = db_model
+
+        super().__init__(name, values, **kwargs)
+
+    @property
+    def key_pairs(self):
+        if self._key_pairs is None:
+            basicfields.SelectField.key_pairs.fset(self, load_options(self.db_model))
+
+        return self._key_pairs
+
+    @key_pairs.setter
+    def key_pairs(self, val):
+        basicfields.SelectField.key_pairs.fset(self, val)
+
+
+class DbCodeSelectField(DbSelectField):
     """
     A select field that loads the database model by code
     """
     def __init__(self, name, db_model, values=None, **kwargs):
         if values is None:
-            # This will only work if the model has a name field
-            values = db_model.query.order_by(db_model.name).all()
             self.valid_codes = None
+            self._valid_code_index = None
         else:
             self.valid_codes = [v.code for v in values]
+            # Index of code to model, so submitted values can be resolved without a query
+            self._valid_code_index = {v.code: v for v in values}
 
-        super(DbCodeSelectField, self).__init__(name, values, **kwargs)
-
-        # Save the database model so that we can query it later
-        self.db_model = db_model
+        super(DbCodeSelectField, self).__init__(name, db_model, values, **kwargs)
 
     def convert_value(self):
         if self.value:
-            if self.valid_codes and self.value not in self.valid_codes:
-                self.error = 'Invalid selection'
+            if self._valid_code_index:
+                loaded_value = self._valid_code_index.get(self.value)
+                if loaded_value is None:
+                    self.error = 'Invalid selection'
+                else:
+                    self.value = loaded_value
             else:
                 loaded_value = self.db_model.query.filter(self.db_model.code == self.value).first()
 
@@ -42,22 +247,20 @@ class DbCodeSelectField(basicfields.SelectField):
                     self.value = None
 
 
-class DbIdSelectField(basicfields.SelectField):
+class DbIdSelectField(DbSelectField):
     """
     A select field that loads the database model by code
     """
     def __init__(self, name, db_model, values=None, **kwargs):
         if values is None:
-            # This will only work if the model has a name field
-            values = db_model.query.order_by(db_model.name).all()
             self.valid_ids = None
+            self._valid_id_index = None
         else:
             self.valid_ids = [v.id for v in values]
+            # Index of id to model, so submitted values can be resolved without a query
+            self._valid_id_index = {v.id: v for v in values}
 
-        super(DbIdSelectField, self).__init__(name, values, **kwargs)
-
-        # Save the database model so that we can query it later
-        self.db_model = db_model
+        super(DbIdSelectField, self).__init__(name, db_model, values, **kwargs)
 
     def convert_value(self):
         if self.value:
@@ -69,11 +272,14 @@ class DbIdSelectField(basicfields.SelectField):
 
             if int_value is None:
                 self.error = 'Invalid'
-                
-            if not self.error and self.valid_ids and int_value not in self.valid_ids:
-                self.error = 'Invalid selection'
 
-            if not self.error:
+            if not self.error and self._valid_id_index:
+                loaded_value = self._valid_id_index.get(int_value)
+                if loaded_value is None:
+                    self.error = 'Invalid selection'
+                else:
+                    self.value = loaded_value
+            elif not self.error:
                 loaded_value = self.db_model.query.filter(self.db_model.id == self.value).first()
 
                 if loaded_value:
@@ -81,4 +287,3 @@ class DbIdSelectField(basicfields.SelectField):
                 else:
                     self.error = 'Invalid value: %s' % self.value
                     self.value = None
-
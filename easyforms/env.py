@@ -22,16 +22,104 @@ def _suppress_none(val):
         return ''
     return val
 
+
+def _create_environment(**kwargs):
+    environment = Environment(loader=FileSystemLoader(_template_path), autoescape=True, **kwargs)
+    environment.undefined = jinja2.StrictUndefined
+    environment.filters['sn'] = _suppress_none
+    environment.globals['url_for'] = url_for
+    environment.globals['hasattr'] = hasattr
+    environment.globals['formtype'] = formtype
+    environment.globals['styles'] = styles
+
+    return environment
+
+
 # Create the jinja2 environment
 _current_path = os.path.dirname(os.path.realpath(__file__))
 _template_path = os.path.join(_current_path, 'templates')
 
-env = Environment(loader=FileSystemLoader(_template_path), autoescape=True)
-env.undefined = jinja2.StrictUndefined
-env.filters['sn'] = _suppress_none
-env.globals['url_for'] = url_for
-env.globals['hasattr'] = hasattr
-env.globals['formtype'] = formtype
-env.globals['styles'] = styles
+env = _create_environment()
+
+# The same environment, but with async rendering enabled for use with render_async()
+async_env = _create_environment(enable_async=True)
+
+
+class TemplateCache(object):
+    """
+    Holds on to the template objects loaded from an environment.  When enabled, each template is
+    only requested from the environment once, after which the same handle is returned without
+    checking the template file on disk
+    """
+    def __init__(self, environment):
+        self.environment = environment
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self._templates = {}
+
+    def get_template(self, name):
+        if not self.enabled:
+            return self.environment.get_template(name)
+
+        template = self._templates.get(name)
+        if template is None:
+            self.misses += 1
+            template = self.environment.get_template(name)
+            self._templates[name] = template
+        else:
+            self.hits += 1
+
+        return template
+
+    def preload(self):
+        """Load every template in the environment into the cache"""
+        for name in self.environment.list_templates(extensions=['html']):
+            if name not in self._templates:
+                self.misses += 1
+                self._templates[name] = self.environment.get_template(name)
+
+    def clear(self):
+        self._templates = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return len(self._templates)
+
+
+template_cache = TemplateCache(env)
+async_template_cache = TemplateCache(async_env)
+
+
+def get_template(name):
+    """Get a template from the easyforms environment, using the template cache if enabled"""
+    return template_cache.get_template(name)
+
+
+def get_async_template(name):
+    """Get a template from the async environment, using the template cache if enabled"""
+    return async_template_cache.get_template(name)
+
+
+def init_production_mode(enabled=True, preload=True):
+    """
+    Switch the template environment in or out of production mode.  In production mode the
+    templates are not checked for changes on disk, and each template is resolved once and
+    then held in the template cache, so rendering a field doesn't touch the filesystem.
 
+    :param enabled: True to enable production mode, False to go back to development mode
+    :param preload: If True (default) load all templates up front, so that the first request
+                    doesn't have to
+    """
+    for environment, cache in ((env, template_cache), (async_env, async_template_cache)):
+        environment.auto_reload = not enabled
+        cache.enabled = enabled
+        cache.clear()
 
+        if enabled and preload:
+            cache.preload()
@@ -24,3 +24,26 @@ class FormNotProcessed(Exception):
 class DuplicateField(Exception):
     pass
 
+
+class InvalidSchema(Exception):
+    pass
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+class ChunkedUploadsNotInitialised(Exception):
+    pass
+
+
+class ChunkStoreFull(Exception):
+    pass
+
+
+class ParkedUploadsNotInitialised(Exception):
+    pass
+
+
+class RecaptchaUnavailable(Exception):
+    pass
@@ -0,0 +1,98 @@
+"""
+Shared configuration for fields.  Most of the options passed to a field (widths, css classes,
+flags) are the same for almost every field, so rather than every field storing its own copy,
+fields with the same configuration share a single interned FieldSpec
+"""
+
+import logging
+import operator
+import threading
+import weakref
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# All of the live specs, keyed by their values
+_specs = weakref.WeakValueDictionary()
+_specs_lock = threading.Lock()
+
+
+class FieldSpec(object):
+    """
+    Immutable set of field options.  Don't create these directly, use get_spec() or replace()
+    so that they are shared
+    """
+    ATTRIBUTES = ('optional', 'css_class', 'readonly', 'strip_value', 'convert_empty_to_none',
+                  'render_after_sections', 'allow_missing', 'width', 'help_text_width',
+                  'label_width', 'units', 'pre_units', 'form_group_css_class', 'noclear',
+                  'requires_multipart', 'column_breakpoint', 'max_width', 'multiple_inputs',
+                  'base_input_css_class', 'allow_duplicates', 'cache_render', 'required')
+
+    __slots__ = ATTRIBUTES + ('_values', '__weakref__')
+
+    def __init__(self, values):
+        object.__setattr__(self, '_values', values)
+        for name, value in zip(self.ATTRIBUTES, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FieldSpec is immutable - use replace()')
+
+    @property
+    def render_cache_key(self):
+        """The spec's values, so render cache fingerprints don't hold on to the spec itself"""
+        return self._values
+
+    def replace(self, **kwargs):
+        """Get the spec with some of the values changed"""
+        values = dict(zip(self.ATTRIBUTES, self._values))
+        values.update(kwargs)
+        return get_spec(**values)
+
+
+def get_spec(**kwargs):
+    """
+    Get the shared spec with the given values
+
+    :param kwargs: A value for each name in FieldSpec.ATTRIBUTES
+    """
+    values = tuple(kwargs[name] for name in FieldSpec.ATTRIBUTES)
+    # The types are included so that i.e. a width of 9 and 9.0 aren't shared
+    key = (values, tuple(value.__class__ for value in values))
+
+    try:
+        spec = _specs.get(key)
+    except TypeError:
+        # Unhashable value - this spec can't be shared
+        return FieldSpec(values)
+
+    if spec is None:
+        with _specs_lock:
+            spec = _specs.get(key)
+            if spec is None:
+                spec = FieldSpec(values)
+                _specs[key] = spec
+
+    return spec
+
+
+def spec_property(name, doc=None):
+    """
+    Create a property for a field that reads a value from the field's spec.  Setting the
+    property switches the field to a spec with the new value, leaving other fields alone
+
+    :param name: The name of the attribute in the spec
+    :param doc: Docstring for the property
+    """
+    # attrgetter avoids a python function call on every read
+    getter = operator.attrgetter('_spec.' + name)
+
+    def setter(self, value):
+        self._spec = self._spec.replace(**{name: value})
+
+    return property(getter, setter, doc=doc)
+
+
+def get_spec_count():
+    return len(_specs)
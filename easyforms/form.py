@@ -3,16 +3,22 @@
 Base classes for forms and fields
 """
 
+import functools
 import logging
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from flask import Markup, request
+from flask import Markup, copy_current_request_context, has_request_context
 
 from . import validate
 from . import exceptions
 from . import formtype
 from . import styles
-from .env import env
+from . import renderplan
+from . import fieldspec
+from .layout import build_attributes, get_layout
+from .submission import Submission
+from .env import get_template, get_async_template
 
 __author__ = 'Stephen Brown (Little Fish Solutions LTD)'
 
@@ -22,6 +28,13 @@ _csrf_generation_function = None
 
 _default_form_type = formtype.HORIZONTAL
 
+# Executor used to process heavy fields.  If None, they are processed inline
+_heavy_field_executor = None
+
+# Field properties that the shared layout provides, and which subclasses may override
+_LAYOUT_PROPERTIES = ('help_text_column_class', 'input_column_class', 'input_column_style',
+                      'form_group_classes', 'form_group_style')
+
 
 def init_csrf(csrf_generation_function):
     """
@@ -49,14 +62,110 @@ def set_default_form_type(form_type):
     _default_form_type = form_type
 
 
+def init_heavy_field_executor(max_workers=None):
+    """
+    Convert heavy fields (see Field.heavy) on a thread pool, so that several heavy fields in the
+    same form are converted at the same time.  Validators still run on the calling thread.  A
+    process pool can't be used, as fields are processed in place.
+
+    Threads only run in parallel while the conversion releases the GIL, i.e. Pillow decoding
+    images, hashing and file IO.  Conversion in pure Python, such as sanitising html, gains
+    little from this
+
+    :param max_workers: The number of threads.  If None, uses the ThreadPoolExecutor default
+    """
+    set_heavy_field_executor(ThreadPoolExecutor(max_workers=max_workers,
+                                                thread_name_prefix='easyforms'))
+
+
+def set_heavy_field_executor(executor):
+    """
+    Set the executor used to process heavy fields.  Pass None to process them inline
+
+    :param executor: A concurrent.futures thread pool, or None
+    """
+    global _heavy_field_executor
+
+    _heavy_field_executor = executor
+
+
+@functools.lru_cache(maxsize=None)
+def _get_overridden_layout_properties(field_class):
+    """Get the names of the layout properties that a field class overrides"""
+    return frozenset(
+        name for name in _LAYOUT_PROPERTIES
+        if getattr(field_class, name) is not getattr(Field, name)
+    )
+
+
+def _process_field(field, data):
+    """Extract, convert and validate the value of a field.  Returns True if it's valid"""
+    field.extract_value(data)
+    return field.validate()
+
+
+def _submit_heavy_field(field, data):
+    """
+    Extract and convert the value of a heavy field on the heavy field executor.  Validation is
+    left to the calling thread, as validators may need the app, request or database session.
+    The request context is copied into the worker, if there is one, for the conversion
+    """
+    extract_value = field.extract_value
+    if has_request_context():
+        extract_value = copy_current_request_context(extract_value)
+
+    return _heavy_field_executor.submit(extract_value, data)
+
+
 class Field(object):
+    # Name of the template used to render this field.  Subclasses set this rather than
+    # overriding render() wherever possible
+    template = None
+
+    # Attributes, other than instance attributes, that affect the rendered html.  These are added
+    # to the fingerprint used by the render cache.  Subclasses can add to this, and the values
+    # from all base classes are included
+    render_cache_attributes = ('style', 'form_type', 'readonly', 'label_width',
+                               'column_breakpoint', 'label_html')
+
+    # Set to True for fields whose conversion is slow (i.e. parsing html or images).  These are
+    # processed on the heavy field executor, if there is one
+    heavy = False
+
+    # The Submission being processed.  Set by the form before the value is extracted
+    submission = None
+
+    # Values stored in the shared spec
+    optional = fieldspec.spec_property('optional')
+    css_class = fieldspec.spec_property('css_class')
+    _readonly = fieldspec.spec_property('readonly')
+    strip_value = fieldspec.spec_property('strip_value')
+    convert_empty_to_none = fieldspec.spec_property('convert_empty_to_none')
+    render_after_sections = fieldspec.spec_property('render_after_sections')
+    allow_missing = fieldspec.spec_property('allow_missing')
+    width = fieldspec.spec_property('width')
+    help_text_width = fieldspec.spec_property('help_text_width')
+    _label_width = fieldspec.spec_property('label_width')
+    units = fieldspec.spec_property('units')
+    pre_units = fieldspec.spec_property('pre_units')
+    form_group_css_class = fieldspec.spec_property('form_group_css_class')
+    noclear = fieldspec.spec_property('noclear')
+    requires_multipart = fieldspec.spec_property('requires_multipart')
+    _column_breakpoint = fieldspec.spec_property('column_breakpoint')
+    max_width = fieldspec.spec_property('max_width')
+    multiple_inputs = fieldspec.spec_property('multiple_inputs')
+    base_input_css_class = fieldspec.spec_property('base_input_css_class')
+    allow_duplicates = fieldspec.spec_property('allow_duplicates')
+    cache_render = fieldspec.spec_property('cache_render')
+    required = fieldspec.spec_property('required')
+
     def __init__(self, name, label=None, value=None, id=None, optional=False, css_class='',
                  readonly=False, help_text=None, strip_value=True, convert_empty_to_none=True,
                  validators=[], required=False, render_after_sections=False, allow_missing=False,
                  width=9, help_text_width=9, label_width=None, units=None, pre_units=None,
                  form_group_css_class=None, noclear=False, requires_multipart=False,
                  column_breakpoint=None, max_width=None, multiple_inputs=False,
-                 base_input_css_class='form-control', allow_duplicates=False):
+                 base_input_css_class='form-control', allow_duplicates=False, cache_render=False):
         """
         :param name: The name of the field (the name field in the generated input)
         :param label: The label text.  If None, is automatically generated from the name
@@ -99,6 +208,11 @@ class Field(object):
                                  there is already a field with the same name. Note that if
                                  duplicate fields are present, only one of them will be retreivable
                                  by name
+        :param cache_render: If set to True, the rendered html for this field will be cached and
+                             reused whenever the field is rendered as part of a form with
+                             exactly the same state.  Only use this for fields whose output
+                             depends solely on their attributes (and those listed in
+                             render_cache_attributes)
         """
         self.name = name
 
@@ -113,37 +227,33 @@ class Field(object):
             self.id = id
 
         self.value = value
-        self.optional = optional
-        self.css_class = css_class
-        self._readonly = readonly
         self.help_text = help_text
-        self.strip_value = strip_value
-        self.convert_empty_to_none = convert_empty_to_none
         self.validators = validators[:]
         self.error = None
-        self.render_after_sections = render_after_sections
-        self.allow_missing = allow_missing
-        self.width = width
-        self.help_text_width = help_text_width
-        self._label_width = label_width
-        self.units = units
-        self.pre_units = pre_units
-        self.form_group_css_class = form_group_css_class
-        self.noclear = noclear
-        self.requires_multipart = requires_multipart
-        self._column_breakpoint = column_breakpoint
-        self.max_width = max_width
-        if isinstance(self.max_width, int):
-            self.max_width = '{}px'.format(self.max_width)
-        self.multiple_inputs = multiple_inputs
-        self.base_input_css_class = base_input_css_class
-        self.allow_duplicates = allow_duplicates
+
+        if isinstance(max_width, int):
+            max_width = '{}px'.format(max_width)
+
+        # Options that are usually the same for lots of fields are kept in a shared spec
+        self._spec = fieldspec.get_spec(
+            optional=optional, css_class=css_class, readonly=readonly, strip_value=strip_value,
+            convert_empty_to_none=convert_empty_to_none,
+            render_after_sections=render_after_sections, allow_missing=allow_missing,
+            width=width, help_text_width=help_text_width, label_width=label_width, units=units,
+            pre_units=pre_units, form_group_css_class=form_group_css_class, noclear=noclear,
+            requires_multipart=requires_multipart, column_breakpoint=column_breakpoint,
+            max_width=max_width, multiple_inputs=multiple_inputs,
+            base_input_css_class=base_input_css_class, allow_duplicates=allow_duplicates,
+            cache_render=cache_render, required=required
+        )
+
+        # Layout snapshot, only set while rendering
+        self._layout = None
 
         # This should get set by the form when we add it
         self.form = None
 
         # Handle common validation options
-        self.required = required
         if required:
             self.validators.append(validate.required)
     
@@ -197,8 +307,81 @@ class Field(object):
     def readonly(self, val):
         self._readonly = val
 
+    def get_submission(self):
+        """
+        The submission being processed.  If the field is being used outside of a form, this
+        falls back to the current flask request
+        """
+        if self.submission is None:
+            return Submission.from_current_request()
+
+        return self.submission
+
+    def clone(self):
+        """
+        Create a copy of this field that isn't attached to a form.  This is a shallow copy, so
+        anything other than the validators is shared with the original field.  Used to create
+        the fields for each instance of a FormSchema
+        """
+        field = self.__class__.__new__(self.__class__)
+        field.__dict__.update(self.__dict__)
+        field.validators = self.validators[:]
+        field.form = None
+        field._layout = None
+        return field
+
+    def get_template_name(self):
+        """The name of the template to render this field with"""
+        return self.template
+
+    def get_template_context(self):
+        """The variables passed into the template when rendering this field"""
+        return {'field': self}
+
     def render(self):
-        return '<div class="alert alert-warning">Render not implemented for {}!</div>'.format(self.__class__.__name__)
+        template_name = self.get_template_name()
+        if template_name is None:
+            return '<div class="alert alert-warning">Render not implemented for {}!</div>'.format(self.__class__.__name__)
+
+        self.snapshot_layout()
+        try:
+            return get_template(template_name).render(self.get_template_context())
+        finally:
+            self.clear_layout_snapshot()
+
+    def render_stream(self):
+        """
+        Render the field as a generator of html fragments.  Fields rendered from a template are
+        streamed with the template's generate() method.  If render() has been overridden, the
+        field is rendered in one go
+        """
+        template_name = self.get_template_name()
+        if template_name is None or self.__class__.render is not Field.render:
+            yield self.render()
+        else:
+            self.snapshot_layout()
+            try:
+                yield from get_template(template_name).generate(self.get_template_context())
+            finally:
+                self.clear_layout_snapshot()
+
+    async def render_async(self):
+        """
+        Render the field using the async template environment.  Any awaitables or async
+        iterables used by the template (i.e. options loaded from an async source) are awaited
+        during rendering.  If render() has been overridden, it is called as normal
+        """
+        template_name = self.get_template_name()
+        if template_name is None or self.__class__.render is not Field.render:
+            return self.render()
+
+        self.snapshot_layout()
+        try:
+            return await get_async_template(template_name).render_async(
+                self.get_template_context()
+            )
+        finally:
+            self.clear_layout_snapshot()
 
     def convert_value(self):
         """Convert the value from the submitted text to whatever type is required.  May cause a validation error."""
@@ -259,78 +442,65 @@ class Field(object):
         """
         return self.form.style if self.form else None
 
+    def get_layout_key(self):
+        """The values that the layout of this field depends on"""
+        return (self.style, self.form_type, self.width, self.help_text_width, self.label_width,
+                self.column_breakpoint, self.max_width, bool(self.error), self.css_class,
+                self.form_group_css_class, self.base_input_css_class)
+
     @property
-    def label_column_class(self):
-        classes = []
-        if self.style == styles.BOOTSTRAP_3:
-            classes.append('control-label')
-        elif self.style == styles.BOOTSTRAP_4:
-            classes.append('col-form-label')
+    def layout(self):
+        """
+        The resolved css classes and attributes for this field.  While the field is being
+        rendered this is a snapshot taken at the start of the render, otherwise it is looked up
+        from the current attributes every time
+        """
+        if self._layout is not None:
+            return self._layout
 
-        if self.form.form_type == formtype.HORIZONTAL and self.label_width > 0:
-            classes.append('col-{breakpoint}-{width}'.format(
-                breakpoint=self.column_breakpoint,
-                width=self.label_width
-            ))
+        return get_layout(self.get_layout_key())
 
-        return ' '.join(classes)
+    def snapshot_layout(self):
+        """Fix the layout for the duration of a render"""
+        self._layout = get_layout(self.get_layout_key())
 
-    @property
-    def input_no_label_column_class(self):
-        if self.form.form_type == formtype.HORIZONTAL:
-            classes = []
-            if self.label_width > 0:
-                if self.style == styles.BOOTSTRAP_3:
-                    classes.append('col-{}-offset-{}'.format(self.column_breakpoint, self.label_width))
-                elif self.style == styles.BOOTSTRAP_4:
-                    classes.append('offset-{}-{}'.format(self.column_breakpoint, self.label_width))
+    def clear_layout_snapshot(self):
+        self._layout = None
 
-            classes.append('col-{}-{}'.format(self.column_breakpoint, self.width))
+    def _overrides_layout(self, *names):
+        """
+        Does this field's class override any of the named layout properties?  If so, the
+        attributes built from them can't be taken from the shared layout
+        """
+        overridden = _get_overridden_layout_properties(self.__class__)
+        return any(name in overridden for name in names)
 
-            return ' '.join(classes)
-        else:
-            return ''
+    @property
+    def label_column_class(self):
+        return self.layout.label_column_class
+
+    @property
+    def input_no_label_column_class(self):
+        return self.layout.input_no_label_column_class
 
     @property
     def help_text_column_class(self):
-        if self.form.form_type == formtype.INLINE:
-            return ''
-        elif self.form.form_type == formtype.HORIZONTAL:
-            classes = []
-            if self.label_width > 0:
-                if self.style == styles.BOOTSTRAP_3:
-                    classes.append('col-{}-offset-{}'.format(self.column_breakpoint, self.label_width))
-                elif self.style == styles.BOOTSTRAP_4:
-                    classes.append('offset-{}-{}'.format(self.column_breakpoint, self.label_width))
-
-            classes.append('col-{}-{}'.format(self.column_breakpoint, self.help_text_width))
-
-            return ' '.join(classes)
-        else:
-            return ''
+        return self.layout.help_text_column_class
 
     @property
     def error_column_class(self):
-        return 'ef-error {}'.format(self.help_text_column_class)
+        if self._overrides_layout('help_text_column_class'):
+            return 'ef-error {}'.format(self.help_text_column_class)
+
+        return self.layout.error_column_class
 
     @property
     def input_column_class(self):
-        if self.form.form_type == formtype.HORIZONTAL:
-            return 'col-{breakpoint}-{width}'.format(
-                breakpoint=self.column_breakpoint,
-                width=self.width
-            )
-        else:
-            return ''
+        return self.layout.input_column_class
 
     @property
     def input_column_style(self):
-        style = []
-        if self.form.form_type == formtype.INLINE:
-            style.append('display: inline;')
-        if self.max_width:
-            style.append('max-width: {};'.format(self.max_width))
-        return ' '.join(style)
+        return self.layout.input_column_style
     
     def get_input_column_attributes(self, extra_classes=None):
         """
@@ -356,17 +526,17 @@ class Field(object):
 
     @property
     def input_column_attributes(self):
-        return self.get_input_column_attributes()
+        if self._overrides_layout('input_column_class', 'input_column_style'):
+            return self.get_input_column_attributes()
+
+        return self.layout.input_column_attributes
 
     @property
     def input_column_no_label_attributes(self):
-        extra_classes = None
-        if self.form_type == formtype.HORIZONTAL and self.label_width > 0:
-            if self.style == styles.BOOTSTRAP_3:
-                extra_classes = 'col-{}-offset-{}'.format(self.column_breakpoint, self.label_width)
-            elif self.style == styles.BOOTSTRAP_4:
-                extra_classes = 'offset-{}-{}'.format(self.column_breakpoint, self.label_width)
-        return self.get_input_column_attributes(extra_classes=extra_classes)
+        if self._overrides_layout('input_column_class', 'input_column_style'):
+            return self.get_input_column_attributes(extra_classes=self.layout.offset_class)
+
+        return self.layout.input_column_no_label_attributes
 
     @property
     def form_group_classes(self):
@@ -378,15 +548,7 @@ class Field(object):
 
         'form-group has-error custom-class'
         """
-        classes = ['form-group']
-        if self.style == styles.BOOTSTRAP_4 and self.form_type == formtype.HORIZONTAL:
-            classes.append('row')
-        if self.error and self.style == styles.BOOTSTRAP_3:
-            classes.append('has-error')
-        if self.form_group_css_class:
-            classes.append(self.form_group_css_class)
-
-        return ' '.join(classes)
+        return self.layout.form_group_classes
 
     @property
     def input_classes(self):
@@ -394,36 +556,22 @@ class Field(object):
         Full list of classes for the class attribute of the input, returned as a string with
         spaces separating each class.
         """
-        classes = [self.base_input_css_class]
-        if self.css_class:
-            classes.append(self.css_class)
-
-        if self.style == styles.BOOTSTRAP_4 and self.error:
-            classes.append('is-invalid')
-
-        return ' '.join(classes)
+        return self.layout.input_classes
 
     @property
     def form_group_style(self):
         """
         Style attribute for form group
         """
-        if self.form.form_type == formtype.INLINE:
-            return 'vertical-align: top'
-        
-        return ''
+        return self.layout.form_group_style
 
     @property
     def form_group_attributes(self):
-        css_classes = self.form_group_classes
-        style = self.form_group_style
-        parts = []
-        if css_classes:
-            parts.append('class="{}"'.format(css_classes))
-        if style:
-            parts.append('style="{}"'.format(style))
-        return Markup(' '.join(parts))
-        
+        if self._overrides_layout('form_group_classes', 'form_group_style'):
+            return build_attributes(self.form_group_classes, self.form_group_style)
+
+        return self.layout.form_group_attributes
+
 
 class FormSection(object):
     def __init__(self, name, fields=[]):
@@ -432,7 +580,39 @@ class FormSection(object):
 
     def render(self):
         """Render the form to HTML"""
-        return Markup(env.get_template('form_section.html').render(section=self))
+        return renderplan.plan_cache.get_section_plan(self).render(self.fields)
+
+    def render_stream(self, chunk_size=renderplan.DEFAULT_CHUNK_SIZE):
+        """Render the section as a generator of html chunks"""
+        plan = renderplan.plan_cache.get_section_plan(self)
+        return renderplan.buffer_chunks(plan.generate(self.fields), chunk_size)
+
+    async def render_async(self):
+        """Render the section using the async template environment"""
+        return await renderplan.plan_cache.get_section_plan(self).render_async(self.fields)
+
+
+class ValidationResult(object):
+    """
+    The outcome of validating one record with Form.validate_many()
+
+    :param index: The position of the record in the input
+    :param values: Dictionary of field name to converted value, for the valid fields
+    :param errors: Dictionary of field name to error message, for the invalid fields
+    """
+    __slots__ = ('index', 'values', 'errors')
+
+    def __init__(self, index, values, errors):
+        self.index = index
+        self.values = values
+        self.errors = errors
+
+    @property
+    def valid(self):
+        return not self.errors
+
+    def __repr__(self):
+        return '<ValidationResult {} {}>'.format(self.index, 'valid' if self.valid else self.errors)
 
 
 class Form(object):
@@ -609,78 +789,88 @@ class Form(object):
     def submitted_hidden_input_name(self):
         return '%s%s' % (self.SUBMITTED_HIDDEN_INPUT_NAME, self.form_name)
 
+    def _get_render_plan(self, generate_csrf_token, render_open_tag=False, render_close_tag=False,
+                         render_before=False, render_sections=False, render_after=False):
+        """
+        Get the cached render plan for rendering all or part of this shape of form
+        """
+        render_flags = (
+            ('render_open_tag', render_open_tag),
+            ('render_close_tag', render_close_tag),
+            ('render_before', render_before),
+            ('render_sections', render_sections),
+            ('render_after', render_after)
+        )
+        return renderplan.plan_cache.get_form_plan(self, generate_csrf_token is not None, render_flags)
+
+    def _render(self, generate_csrf_token, **kwargs):
+        plan = self._get_render_plan(generate_csrf_token, **kwargs)
+        return plan.render(self.all_fields, generate_csrf_token)
+
     def render(self):
         """Render the form and all sections to HTML"""
-        return Markup(env.get_template('form.html').render(form=self,
-                                                           render_open_tag=True,
-                                                           render_close_tag=True,
-                                                           render_before=True,
-                                                           render_sections=True,
-                                                           render_after=True,
-                                                           generate_csrf_token=None if self.disable_csrf else _csrf_generation_function))
+        return self._render(None if self.disable_csrf else _csrf_generation_function,
+                            render_open_tag=True, render_close_tag=True, render_before=True,
+                            render_sections=True, render_after=True)
+
+    async def render_async(self):
+        """Render the form and all sections to HTML using the async template environment"""
+        generate_csrf_token = None if self.disable_csrf else _csrf_generation_function
+        plan = self._get_render_plan(generate_csrf_token, render_open_tag=True, render_close_tag=True,
+                                     render_before=True, render_sections=True, render_after=True)
+        return await plan.render_async(self.all_fields, generate_csrf_token)
 
     def render_before_sections(self):
         """Render the form up to the first section.  This will open the form tag but not close it."""
-        return Markup(env.get_template('form.html').render(form=self,
-                                                           render_open_tag=True,
-                                                           render_close_tag=False,
-                                                           render_before=True,
-                                                           render_sections=False,
-                                                           render_after=False,
-                                                           generate_csrf_token=None if self.action else _csrf_generation_function))
+        return self._render(None if self.action else _csrf_generation_function,
+                            render_open_tag=True, render_before=True)
 
     def render_after_sections(self):
         """Render the form up to the first section.  This will close the form tag, but not open it."""
-        return Markup(env.get_template('form.html').render(form=self,
-                                                           render_open_tag=False,
-                                                           render_close_tag=True,
-                                                           render_before=False,
-                                                           render_sections=False,
-                                                           render_after=True,
-                                                           generate_csrf_token=None if self.action else _csrf_generation_function))
+        return self._render(None if self.action else _csrf_generation_function,
+                            render_close_tag=True, render_after=True)
 
     def render_sections(self):
         """
         Renders all sections in the form, each inside a fieldset with the legend generated from the section name.
         No form tag is included: just the inputs are rendered.
         """
-        return Markup(env.get_template('form.html').render(form=self,
-                                                           render_open_tag=False,
-                                                           render_close_tag=False,
-                                                           render_before=False,
-                                                           render_sections=True,
-                                                           render_after=False,
-                                                           generate_csrf_token=_csrf_generation_function))
+        return self._render(_csrf_generation_function, render_sections=True)
 
     def render_start(self):
         """
         This will open the form, without rendering any fields at all
         """
-        return Markup(env.get_template('form.html').render(form=self,
-                                                           render_open_tag=True,
-                                                           render_close_tag=False,
-                                                           render_before=False,
-                                                           render_sections=False,
-                                                           render_after=False,
-                                                           generate_csrf_token=_csrf_generation_function))
+        return self._render(_csrf_generation_function, render_open_tag=True)
         
     def render_end(self):
         """
         This will close the form, without rendering any fields at all
         """
-        return Markup(env.get_template('form.html').render(form=self,
-                                                           render_open_tag=False,
-                                                           render_close_tag=True,
-                                                           render_before=False,
-                                                           render_sections=False,
-                                                           render_after=False,
-                                                           generate_csrf_token=_csrf_generation_function))
+        return self._render(_csrf_generation_function, render_close_tag=True)
     
+    def render_stream(self, chunk_size=renderplan.DEFAULT_CHUNK_SIZE):
+        """
+        Render the form and all sections as a generator of html chunks, each at least chunk_size
+        characters long (apart from the last one).  This can be passed into a streaming response
+        so that the start of the form can be sent before the rest of it has been rendered
+        """
+        generate_csrf_token = None if self.disable_csrf else _csrf_generation_function
+        plan = self._get_render_plan(generate_csrf_token, render_open_tag=True, render_close_tag=True,
+                                     render_before=True, render_sections=True, render_after=True)
+        return renderplan.buffer_chunks(plan.generate(self.all_fields, generate_csrf_token), chunk_size)
+
     def render_section(self, name):
         return self.get_section(name).render()
 
+    def render_section_stream(self, name, chunk_size=renderplan.DEFAULT_CHUNK_SIZE):
+        return self.get_section(name).render_stream(chunk_size)
+
     def render_field(self, name):
-        return Markup(self.get_field(name).render())
+        return renderplan.render_field(self.get_field(name))
+
+    def render_field_stream(self, name, chunk_size=renderplan.DEFAULT_CHUNK_SIZE):
+        return renderplan.buffer_chunks(renderplan.stream_field(self.get_field(name)), chunk_size)
 
     def is_section_empty(self, name):
         return not self.get_section(name).fields
@@ -698,34 +888,125 @@ class Form(object):
             return all_fields
 
     def read_form_data(self):
-        """Attempt to read the form data from the request"""
+        """Attempt to read the form data from the current flask request"""
         if self.processed_data:
             raise exceptions.AlreadyProcessed('The data has already been processed for this form')
         
         if self.readonly:
             return
 
-        if request.method == self.method:
-            if self.method == 'POST':
-                data = request.form
-            else:
-                data = request.args
+        self.process(Submission.from_request())
+
+    def process(self, submission):
+        """
+        Process submitted form data.  This doesn't need a flask request, so can be used anywhere
+
+        :param submission: A Submission with the submitted data
+        """
+        if self.processed_data:
+            raise exceptions.AlreadyProcessed('The data has already been processed for this form')
+
+        if self.readonly:
+            return
+
+        if submission.method == self.method:
+            data = submission.data
 
             if self.submitted_hidden_input_name in data:
                 # The form has been submitted
                 self.processed_data = True
 
-                for field in self.all_fields:
-                    # We need to skip readonly fields
-                    if field.readonly:
-                        pass
+                # We need to skip readonly fields
+                fields = [field for field in self.all_fields if not field.readonly]
+
+                # Start the heavy fields first so that they run alongside the others
+                futures = {}
+                try:
+                    for field in fields:
+                        field.submission = submission
+                        if field.heavy and _heavy_field_executor is not None:
+                            futures[field] = _submit_heavy_field(field, data)
+
+                    results = []
+                    for field in fields:
+                        if field in futures:
+                            results.append(None)
+                        else:
+                            results.append(_process_field(field, data))
+
+                    # Merge in the heavy field results, in field order, validating them on this
+                    # thread
+                    for i, field in enumerate(fields):
+                        if field in futures:
+                            futures[field].result()
+                            results[i] = field.validate()
+                except BaseException:
+                    # Don't leave heavy fields being converted in the background once processing
+                    # has failed
+                    for future in futures.values():
+                        future.cancel()
+                    wait(futures.values())
+                    raise
+
+                for field, valid in zip(fields, results):
+                    if not valid:
+                        log.debug('Validation error in field \'%s\': %s' % (field.name, field.error))
+                        self.has_errors = True
+
+    def validate_many(self, records, fail_fast=False):
+        """
+        Validate lots of records against this form's fields, i.e. from an API batch or an
+        import.  The same field objects are reused for every record, and their state is put
+        back afterwards, so this doesn't affect the form.  Not thread safe - use a separate form
+        in each thread.  Readonly fields are skipped, as with read_form_data()
+
+        :param records: Iterable of Submission objects, or of mappings of field name to
+                        submitted value (as strings, as they would be submitted).  Mappings
+                        without getlist() (i.e. plain dicts) are wrapped in a MultiDict, with
+                        lists becoming multiple values
+        :param fail_fast: If True, stop after the first record with an error
+        :return: List of ValidationResult, one per record processed
+        """
+        fields = [field for field in self.all_fields if not field.readonly]
+        saved_state = [(field, field.__dict__.copy()) for field in fields]
+
+        results = []
+        try:
+            for index, record in enumerate(records):
+                if not isinstance(record, Submission):
+                    record = Submission(record)
+
+                values = {}
+                errors = {}
+                for field in fields:
+                    # Start each record from scratch, so nothing carries over from the form or
+                    # the previous record
+                    field.value = None
+                    field.error = None
+                    field.submission = record
+
+                    try:
+                        field.extract_value(record.data)
+                    except (exceptions.FieldNotFound, KeyError):
+                        # Fields with several inputs (i.e. DateSelectField) index the data
+                        # directly, so a missing input is a KeyError
+                        field.error = 'Missing'
+
+                    if field.validate():
+                        values[field.name] = field.value
                     else:
-                        field.extract_value(data)
+                        errors[field.name] = field.error
+
+                results.append(ValidationResult(index, values, errors))
+
+                if fail_fast and errors:
+                    break
+        finally:
+            for field, state in saved_state:
+                field.__dict__.clear()
+                field.__dict__.update(state)
 
-                        # Validate the field
-                        if not field.validate():
-                            log.debug('Validation error in field \'%s\': %s' % (field.name, field.error))
-                            self.has_errors = True
+        return results
 
     def __getitem__(self, item):
         if not self.processed_data:
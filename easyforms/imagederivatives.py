@@ -0,0 +1,142 @@
+"""
+Derived versions of uploaded images (thumbnails, web sized copies etc.).  An ImageUploadField
+with derivatives hands the image it has already decoded to a background pool, which resizes and
+encodes each derivative, so the view doesn't have to decode the upload again and doesn't have
+to wait for the derivatives unless it needs them
+"""
+
+import io
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# The pool that derivatives are made on.  If None they are made on the calling thread
+_derivative_executor = None
+
+
+class Derivative(object):
+    """
+    A version of an uploaded image to create
+
+    :param name: The key of the derivative in the results
+    :param max_width: The largest width of the derivative.  The aspect ratio is kept, and images
+                      are never made larger
+    :param max_height: The largest height of the derivative
+    :param format: Pillow format name, i.e. 'JPEG', 'PNG' or 'WEBP'
+    :param quality: Quality for lossy formats
+    """
+    def __init__(self, name, max_width=None, max_height=None, format='JPEG', quality=85):
+        self.name = name
+        self.max_width = max_width
+        self.max_height = max_height
+        self.format = format
+        self.quality = quality
+
+    def get_size(self, width, height):
+        """Get the size of the derivative of an image with the given size"""
+        scale = 1
+        if self.max_width is not None:
+            scale = min(scale, self.max_width / width)
+        if self.max_height is not None:
+            scale = min(scale, self.max_height / height)
+
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def make(self, image):
+        """
+        Create the derivative.  The image isn't modified, so it can be shared with the view
+
+        :return: The encoded derivative as bytes
+        """
+        from PIL import Image
+
+        size = self.get_size(*image.size)
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+        if self.format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        image.save(output, format=self.format, quality=self.quality)
+        return output.getvalue()
+
+
+def make_derivatives(image, derivatives):
+    """
+    Make each derivative of an image
+
+    :return: A dictionary of derivative name => encoded bytes
+    """
+    return {derivative.name: derivative.make(image) for derivative in derivatives}
+
+
+class BoundedExecutor(object):
+    """
+    Thread pool with a limit on the number of queued jobs.  Images are large, so once the limit
+    is reached submit() waits for a job to finish rather than letting the queue grow
+
+    :param max_workers: The number of threads
+    :param max_pending: The most jobs, running or waiting, at any time
+    """
+    def __init__(self, max_workers=2, max_pending=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='easyforms-derivatives')
+        self.semaphore = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        self.semaphore.acquire()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+        future.add_done_callback(lambda f: self.semaphore.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def init_derivative_executor(max_workers=2, max_pending=8):
+    """
+    Make image derivatives on a background pool.  Call this when initialising the app
+
+    :param max_workers: The number of threads
+    :param max_pending: The most images waiting for, or having, derivatives made at any time
+    """
+    set_derivative_executor(BoundedExecutor(max_workers=max_workers, max_pending=max_pending))
+
+
+def set_derivative_executor(executor):
+    """
+    Set the executor used to make derivatives.  Pass None to make them on the calling thread
+
+    :param executor: Anything with a concurrent.futures style submit() method, or None
+    """
+    global _derivative_executor
+
+    _derivative_executor = executor
+
+
+def submit_derivatives(image, derivatives):
+    """
+    Make the derivatives of a decoded image on the derivative executor
+
+    :return: A Future whose result is a dictionary of derivative name => encoded bytes
+    """
+    if _derivative_executor is not None:
+        return _derivative_executor.submit(make_derivatives, image, derivatives)
+
+    future = Future()
+    try:
+        future.set_result(make_derivatives(image, derivatives))
+    except Exception as e:
+        future.set_exception(e)
+
+    return future
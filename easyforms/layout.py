@@ -0,0 +1,140 @@
+"""
+Resolved layout (Bootstrap grid classes and attributes) for fields.  The layout of a field only
+depends on a handful of values, so each distinct combination is computed once and shared
+between all fields with the same layout.
+"""
+
+import logging
+import threading
+
+from markupsafe import Markup
+
+from . import formtype
+from . import styles
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# All layouts that have been computed, keyed by the values they were computed from
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+def build_attributes(css_classes, style):
+    """Build the class and style attributes of an element, leaving out empty ones"""
+    parts = []
+    if css_classes:
+        parts.append('class="{}"'.format(css_classes))
+    if style:
+        parts.append('style="{}"'.format(style))
+
+    return Markup(' '.join(parts))
+
+
+class FieldLayout(object):
+    """
+    All of the css classes and attributes used to lay out a field.  Don't create these directly,
+    use get_layout() so that they are shared.  These must not be modified
+    """
+    def __init__(self, style, form_type, width, help_text_width, label_width, column_breakpoint,
+                 max_width, has_error, css_class, form_group_css_class, base_input_css_class):
+        horizontal = form_type == formtype.HORIZONTAL
+
+        # The offset used to line things up with the input when there is a label
+        offset_class = None
+        if horizontal and label_width > 0:
+            if style == styles.BOOTSTRAP_3:
+                offset_class = 'col-{}-offset-{}'.format(column_breakpoint, label_width)
+            elif style == styles.BOOTSTRAP_4:
+                offset_class = 'offset-{}-{}'.format(column_breakpoint, label_width)
+
+        # Label
+        classes = []
+        if style == styles.BOOTSTRAP_3:
+            classes.append('control-label')
+        elif style == styles.BOOTSTRAP_4:
+            classes.append('col-form-label')
+
+        if horizontal and label_width > 0:
+            classes.append('col-{}-{}'.format(column_breakpoint, label_width))
+
+        self.label_column_class = ' '.join(classes)
+
+        self.offset_class = offset_class
+
+        # Input column
+        if horizontal:
+            self.input_column_class = 'col-{}-{}'.format(column_breakpoint, width)
+            self.input_no_label_column_class = ' '.join(
+                [c for c in (offset_class, self.input_column_class) if c]
+            )
+            self.help_text_column_class = ' '.join(
+                [c for c in (offset_class, 'col-{}-{}'.format(column_breakpoint, help_text_width)) if c]
+            )
+        else:
+            self.input_column_class = ''
+            self.input_no_label_column_class = ''
+            self.help_text_column_class = ''
+
+        self.error_column_class = 'ef-error {}'.format(self.help_text_column_class)
+
+        style_parts = []
+        if form_type == formtype.INLINE:
+            style_parts.append('display: inline;')
+        if max_width:
+            style_parts.append('max-width: {};'.format(max_width))
+        self.input_column_style = ' '.join(style_parts)
+
+        self.input_column_attributes = build_attributes(self.input_column_class,
+                                                        self.input_column_style)
+
+        no_label_classes = ' '.join([c for c in (self.input_column_class, offset_class) if c])
+        self.input_column_no_label_attributes = build_attributes(no_label_classes,
+                                                                 self.input_column_style)
+
+        # Form group
+        classes = ['form-group']
+        if style == styles.BOOTSTRAP_4 and horizontal:
+            classes.append('row')
+        if has_error and style == styles.BOOTSTRAP_3:
+            classes.append('has-error')
+        if form_group_css_class:
+            classes.append(form_group_css_class)
+        self.form_group_classes = ' '.join(classes)
+
+        self.form_group_style = 'vertical-align: top' if form_type == formtype.INLINE else ''
+        self.form_group_attributes = build_attributes(self.form_group_classes,
+                                                      self.form_group_style)
+
+        # Input
+        classes = [base_input_css_class]
+        if css_class:
+            classes.append(css_class)
+        if style == styles.BOOTSTRAP_4 and has_error:
+            classes.append('is-invalid')
+        self.input_classes = ' '.join(classes)
+
+
+def get_layout(key):
+    """
+    Get the shared layout for a key, computing it if this is the first time it's been seen
+
+    :param key: Tuple of the arguments to FieldLayout
+    """
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = FieldLayout(*key)
+        with _layouts_lock:
+            layout = _layouts.setdefault(key, layout)
+
+    return layout
+
+
+def clear_layouts():
+    with _layouts_lock:
+        _layouts.clear()
+
+
+def get_layout_count():
+    return len(_layouts)
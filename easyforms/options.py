@@ -0,0 +1,300 @@
+"""
+Prerendered option lists for select-family fields.  Rendering thousands of options through a
+template loop is slow, so the html for each distinct list of options is built once and shared.
+Rendering a field then only has to insert the selected marker into the prerendered html.
+"""
+
+import logging
+import functools
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup, escape
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# Used to tell a missing attribute apart from None
+MISSING = object()
+
+
+class OptionFormat(object):
+    """
+    How to render a single option
+
+    :param html: Format string for an option.  {value}, {name} and {index} are filled in for
+                 each option, along with {selected} which marks the point where the selected
+                 marker is inserted.  Any other names are filled in from the context
+    :param selected_marker: The html inserted into a selected option
+    :param context_attributes: The field attributes needed to fill in the format string
+    """
+    def __init__(self, html, selected_marker, context_attributes=()):
+        self.html = html
+        self.selected_marker = selected_marker
+        self.context_attributes = context_attributes
+
+
+SELECT = OptionFormat(
+    '<option value="{value}"{selected}>{name}</option>',
+    ' selected="selected"'
+)
+
+RADIO = OptionFormat(
+    '<div class="radio form-check"><label class="form-check-label">'
+    '<input type="radio" name="{field_name}" id="{field_id}-{index}" value="{value}" '
+    'class="form-check-input"{readonly}{selected}>{name}</label></div>',
+    ' checked',
+    ('field_name', 'field_id', 'readonly')
+)
+
+_formats = {
+    'select': SELECT,
+    'radio': RADIO
+}
+
+
+def get_option_format(name):
+    return _formats[name]
+
+
+def register_option_format(name, option_format):
+    """
+    Add a new option format that can be used with SelectField.render_options()
+
+    :param name: The name used to refer to the format in templates
+    :param option_format: An OptionFormat
+    """
+    _formats[name] = option_format
+
+
+class OptionList(object):
+    """
+    The html for a list of options with the selected marker left out, plus the position at
+    which the marker should be inserted for each option
+
+    :param option_format: The OptionFormat to render with
+    :param items: Sequence of (value, name) tuples
+    :param context: Dictionary of extra values to fill in the format string.  These will be
+                    escaped
+    """
+    def __init__(self, option_format, items, context=None):
+        escaped_context = {key: escape(value) for key, value in (context or {}).items()}
+        head, tail = option_format.html.split('{selected}')
+
+        parts = []
+        offsets = []
+        position = 0
+        for index, (value, name) in enumerate(items):
+            option_head = head.format(value=escape(value), name=escape(name), index=index,
+                                      **escaped_context)
+            option_tail = tail.format(value=escape(value), name=escape(name), index=index,
+                                      **escaped_context)
+            parts.append(option_head)
+            parts.append(option_tail)
+            position += len(option_head)
+            offsets.append(position)
+            position += len(option_tail)
+
+        self.html = ''.join(parts)
+        self.offsets = offsets
+        self.selected_marker = option_format.selected_marker
+
+        # Index of option value to the positions of the options with that value
+        self.values = [value for value, name in items]
+        self._str_index = None
+        self.index = {}
+        try:
+            for position, value in enumerate(self.values):
+                self.index.setdefault(value, []).append(position)
+        except TypeError:
+            # Unhashable values
+            self.index = None
+
+    def find(self, value):
+        """
+        Get the indices of all options with the given value
+
+        :param value: The value to look up
+        """
+        if self.index is not None:
+            try:
+                return self.index.get(value, ())
+            except TypeError:
+                pass
+
+        return [position for position, option_value in enumerate(self.values)
+                if option_value == value]
+
+    def find_str(self, value):
+        """
+        Get the indices of all options whose value converted to a string equals the given
+        string.  Used to match submitted values against non-string option values
+
+        :param value: The string to look up
+        """
+        str_index = self._str_index
+        if str_index is None:
+            str_index = {}
+            for position, option_value in enumerate(self.values):
+                str_index.setdefault(str(option_value), []).append(position)
+            self._str_index = str_index
+
+        return str_index.get(value, ())
+
+    def render(self, selected_indices=()):
+        """
+        Get the html for the options
+
+        :param selected_indices: The indices of the options to mark as selected
+        """
+        if not selected_indices:
+            return Markup(self.html)
+
+        parts = []
+        start = 0
+        for index in sorted(selected_indices):
+            offset = self.offsets[index]
+            parts.append(self.html[start:offset])
+            parts.append(self.selected_marker)
+            start = offset
+
+        parts.append(self.html[start:])
+
+        return Markup(''.join(parts))
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class OptionListCache(object):
+    """
+    Least recently used cache of option lists, keyed by the format, context and the values and
+    names of the options.  Fields with the same options share the same prerendered html
+    """
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_option_list(self, option_format, items, context=None):
+        """
+        :param option_format: The OptionFormat to render with
+        :param items: Tuple of (value, name) tuples
+        :param context: Dictionary of extra values for the format string
+        """
+        try:
+            # The types are included so that i.e. 1 and True aren't treated as the same option
+            types = tuple((value.__class__, name.__class__) for value, name in items)
+            key = (option_format.html, option_format.selected_marker,
+                   tuple(sorted((context or {}).items())), items, types)
+            hash(key)
+        except TypeError:
+            # Unhashable values or names - just build it
+            return OptionList(option_format, items, context)
+
+        with self._lock:
+            option_list = self._lists.get(key)
+            if option_list is not None:
+                self._lists.move_to_end(key)
+                self.hits += 1
+                return option_list
+
+            self.misses += 1
+
+        option_list = OptionList(option_format, items, context)
+
+        with self._lock:
+            self._lists[key] = option_list
+            while len(self._lists) > self.max_size:
+                self._lists.popitem(last=False)
+
+        return option_list
+
+    def clear(self):
+        with self._lock:
+            self._lists.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def size(self):
+        return len(self._lists)
+
+
+option_list_cache = OptionListCache()
+
+
+MONTH_NAMES = ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+               'September', 'October', 'November', 'December')
+
+# Shared options for the date select fields.  These never change, so are only built once
+DAY_OPTIONS = OptionList(SELECT, tuple((day, day) for day in range(1, 32)))
+MONTH_OPTIONS = OptionList(SELECT, tuple((i + 1, name) for i, name in enumerate(MONTH_NAMES)))
+
+
+@functools.lru_cache(maxsize=32)
+def _get_year_option_list(years):
+    return OptionList(SELECT, tuple((year, year) for year in years))
+
+
+def get_year_options(years):
+    """
+    Get the shared options for a list or range of years
+
+    :param years: Range or sequence of years
+    """
+    if not isinstance(years, range):
+        years = tuple(years)
+
+    return _get_year_option_list(years)
+
+
+def render_selected(option_list, value):
+    """
+    Render an option list with the options matching the value selected
+
+    :param option_list: The OptionList to render
+    :param value: The value to select
+    """
+    return option_list.render(option_list.find(value))
+
+
+def make_value_set(values):
+    """
+    Make a set of values for fast membership tests, falling back to a list if any of the
+    values are unhashable.  Test membership with value_in()
+    """
+    # Take a copy first, so that an iterator isn't half used up when set() fails
+    values = list(values)
+    try:
+        return set(values)
+    except TypeError:
+        return values
+
+
+def value_in(value, value_set):
+    """
+    Is the value in a set made by make_value_set()?  Unhashable values can't be looked up in a
+    set, so they are compared with each value in turn
+    """
+    try:
+        return value in value_set
+    except TypeError:
+        return any(value == v for v in value_set)
+
+
+def is_reiterable(key_pairs):
+    """
+    Can the key pairs be iterated over more than once without side effects?  Generators and
+    async iterables can't be prerendered, so are rendered in the template instead
+    """
+    if hasattr(key_pairs, '__aiter__'):
+        return False
+
+    try:
+        return iter(key_pairs) is not key_pairs
+    except TypeError:
+        return False
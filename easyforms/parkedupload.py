@@ -0,0 +1,173 @@
+"""
+Keeps accepted uploads when a form is re-displayed because of an error in another field.  The
+upload is parked in a local directory when the form is rendered again, and the form carries a
+signed token instead of asking for the file again.  The next submission resolves the token to
+the parked file, unless a new file is selected.  Tokens only work for the field, and the user
+session, that the file was parked for.
+
+To use, initialise the store when creating the app:
+
+    parkedupload.init_parked_uploads(app, '/var/tmp/parked-uploads')
+
+and pass park_uploads=True to the upload fields
+"""
+
+import logging
+import os
+import secrets
+import shutil
+import threading
+import time
+
+from flask import has_request_context, session
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.datastructures import FileStorage
+
+from . import exceptions
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+_file_id_length = 32
+
+# The session key holding the random value that tokens are tied to
+_session_nonce_key = '_easyforms_parking_nonce'
+
+# The store used by the fields
+_parking_store = None
+
+
+def _get_session_nonce(create):
+    """
+    Get the random value stored in the session for tying tokens to it, or None outside of a
+    request
+
+    :param create: If True, store a new one if the session doesn't have one yet
+    """
+    if not has_request_context():
+        return None
+
+    nonce = session.get(_session_nonce_key)
+    if nonce is None and create:
+        nonce = secrets.token_hex(16)
+        session[_session_nonce_key] = nonce
+
+    return nonce
+
+
+class ParkingStore(object):
+    """
+    Directory of parked uploads, each referred to by a signed token that expires after ttl
+
+    :param directory: The directory to keep the parked files in
+    :param secret_key: The key used to sign the tokens
+    :param ttl: The number of seconds that a parked upload is kept for
+    """
+    def __init__(self, directory, secret_key, ttl=60 * 60):
+        self.directory = directory
+        self.ttl = ttl
+        self.serializer = URLSafeTimedSerializer(secret_key, salt='easyforms-parked-upload')
+        self._last_cleanup = 0
+        self._cleanup_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def park(self, stream, filename, field_name):
+        """
+        Copy an upload into the store
+
+        :param stream: The uploaded file stream.  Copied from the start
+        :param filename: The uploaded file name
+        :param field_name: The name of the field the file was uploaded to.  The token can only
+                           be opened for the same field, and in the same session
+        :return: The token for the parked file
+        """
+        self.cleanup_if_due()
+
+        file_id = secrets.token_hex(_file_id_length // 2)
+        position = stream.tell()
+        try:
+            stream.seek(0)
+            with open(os.path.join(self.directory, file_id), 'wb') as f:
+                shutil.copyfileobj(stream, f)
+        finally:
+            stream.seek(position)
+
+        return self.serializer.dumps([file_id, filename, field_name, _get_session_nonce(True)])
+
+    def open(self, token, field_name):
+        """
+        Get a parked upload as a FileStorage, like the ones in request.files.  The caller should
+        close it when it's done with it
+
+        :param token: The token returned by park()
+        :param field_name: The name of the field the token was submitted for
+        :return: The FileStorage, or None if the token is invalid, has expired, or was issued
+                 for another field or session
+        """
+        try:
+            file_id, filename, token_field_name, nonce = self.serializer.loads(token,
+                                                                               max_age=self.ttl)
+        except (BadSignature, TypeError, ValueError):
+            return None
+
+        if token_field_name != field_name or nonce != _get_session_nonce(False):
+            return None
+
+        try:
+            stream = open(os.path.join(self.directory, os.path.basename(file_id)), 'rb')
+        except OSError:
+            return None
+
+        return FileStorage(stream, filename=filename)
+
+    def cleanup(self):
+        """Delete parked files older than the ttl"""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if len(name) == _file_id_length and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                log.warning('Failed to remove parked upload {}'.format(path))
+
+    def cleanup_if_due(self):
+        """Clean up at most ten times per ttl, rather than every time a file is parked"""
+        now = time.time()
+        if now - self._last_cleanup < self.ttl / 10:
+            return
+
+        with self._cleanup_lock:
+            if now - self._last_cleanup < self.ttl / 10:
+                return
+            self._last_cleanup = now
+
+        self.cleanup()
+
+
+def init_parked_uploads(app, directory, ttl=60 * 60):
+    """
+    Enable parking uploads.  Call this when creating the app
+
+    :param app: The flask app.  Tokens are signed with its secret key
+    :param directory: Where to keep the parked files
+    :param ttl: The number of seconds that a parked upload is kept for
+    """
+    global _parking_store
+
+    _parking_store = ParkingStore(directory, app.secret_key, ttl=ttl)
+    return _parking_store
+
+
+def set_parking_store(parking_store):
+    global _parking_store
+
+    _parking_store = parking_store
+
+
+def get_parking_store():
+    if _parking_store is None:
+        raise exceptions.ParkedUploadsNotInitialised('Call parkedupload.init_parked_uploads() to '
+                                                     'park uploads')
+    return _parking_store
@@ -0,0 +1,215 @@
+"""
+Verification of recaptcha responses.  A single verifier is shared by all RecaptchaFields, so
+connections to the verification service are pooled, every request has a timeout, and if the
+service keeps failing a circuit breaker stops calling it for a while
+"""
+
+import logging
+import threading
+import time
+
+import requests
+from flask import current_app, has_request_context, session
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from requests.adapters import HTTPAdapter
+
+from . import exceptions
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+
+# Prefix of the session keys holding the verified markers
+_session_key_prefix = '_easyforms_recaptcha_'
+
+# The verifier used by fields that don't have their own.  Created when first needed
+_recaptcha_verifier = None
+_recaptcha_verifier_lock = threading.Lock()
+
+
+class RecaptchaVerifier(object):
+    """
+    Checks recaptcha responses with the verification service
+
+    :param url: The verification url.  Point this at a stub server for tests and benchmarks
+    :param connect_timeout: Seconds to wait for a connection
+    :param read_timeout: Seconds to wait for the response
+    :param pool_size: The number of connections to keep open
+    :param failure_threshold: The number of failures in a row that opens the circuit breaker
+    :param reset_timeout: Seconds to wait, once the breaker is open, before trying the service
+                          again
+    :param fail_open: What to do if the service can't be reached or the breaker is open.  If
+                      True, responses are accepted without being checked.  If False (the
+                      default) verify() raises RecaptchaUnavailable
+    """
+    def __init__(self, url=VERIFY_URL, connect_timeout=3.05, read_timeout=5, pool_size=10,
+                 failure_threshold=5, reset_timeout=30, fail_open=False):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fail_open = fail_open
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def circuit_open(self):
+        return self._opened_at is not None
+
+    def _allow_request(self):
+        """Check the circuit breaker.  Once reset_timeout has passed, one request is let through"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # Let this request try the service, and keep the rest out until it's done
+                self._opened_at = now
+                return True
+
+            return False
+
+    def _record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def _record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    log.warning('Recaptcha verification failed {} times in a row - not trying '
+                                'again for {} seconds'.format(self._failures, self.reset_timeout))
+                self._opened_at = time.monotonic()
+
+    def _unavailable(self, reason):
+        if self.fail_open:
+            log.warning('Accepting unchecked recaptcha: {}'.format(reason))
+            return True
+
+        raise exceptions.RecaptchaUnavailable(reason)
+
+    def verify(self, secret_key, response, remote_addr=None):
+        """
+        Check a recaptcha response
+
+        :param secret_key: The secret key for the recaptcha
+        :param response: The g-recaptcha-response submitted with the form
+        :param remote_addr: The ip address of the user
+        :return: True if the recaptcha was completed, otherwise False
+        """
+        if not self._allow_request():
+            return self._unavailable('circuit breaker is open')
+
+        data = {
+            'secret': secret_key,
+            'response': response,
+            'remoteip': remote_addr
+        }
+
+        try:
+            r = self.session.post(self.url, data, timeout=self.timeout)
+            if r.status_code != 200:
+                raise ValueError('response code {}'.format(r.status_code))
+            resp = r.json()
+        except (requests.RequestException, ValueError) as e:
+            self._record_failure()
+            return self._unavailable('verification failed: {}'.format(e))
+
+        self._record_success()
+
+        if resp.get('success'):
+            return True
+
+        log.debug('Recaptcha failed with error codes: {}'.format(
+            ', '.join(resp.get('error-codes') or [])
+        ))
+        return False
+
+
+def init_recaptcha_verifier(**kwargs):
+    """
+    Configure the verifier used by RecaptchaFields.  Call this when initialising the app
+
+    :param kwargs: Arguments for RecaptchaVerifier
+    """
+    set_recaptcha_verifier(RecaptchaVerifier(**kwargs))
+
+
+def set_recaptcha_verifier(verifier):
+    """
+    Replace the verifier used by RecaptchaFields.  Pass None to go back to a default one
+
+    :param verifier: Anything with the same verify() method as RecaptchaVerifier
+    """
+    global _recaptcha_verifier
+
+    _recaptcha_verifier = verifier
+
+
+def get_recaptcha_verifier():
+    global _recaptcha_verifier
+
+    if _recaptcha_verifier is None:
+        with _recaptcha_verifier_lock:
+            if _recaptcha_verifier is None:
+                _recaptcha_verifier = RecaptchaVerifier()
+
+    return _recaptcha_verifier
+
+
+def _get_marker_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='easyforms-recaptcha-verified')
+
+
+def remember_verification(form_name):
+    """
+    Record in the session that the user has completed the recaptcha for a form
+
+    :param form_name: The name of the form the recaptcha was completed on
+    """
+    if not has_request_context():
+        return
+
+    session[_session_key_prefix + form_name] = _get_marker_serializer().dumps(form_name)
+
+
+def is_verified(form_name, max_age):
+    """
+    Check whether the user has completed the recaptcha for a form recently
+
+    :param form_name: The name of the form
+    :param max_age: How long ago, in seconds, the recaptcha can have been completed
+    """
+    if not has_request_context():
+        return False
+
+    marker = session.get(_session_key_prefix + form_name)
+    if not marker:
+        return False
+
+    try:
+        return _get_marker_serializer().loads(marker, max_age=max_age) == form_name
+    except BadSignature:
+        return False
+
+
+def forget_verification(form_name):
+    """
+    Remove the marker for a form, so the next submission needs a new recaptcha.  With a cookie
+    session this only removes it from the current cookie - a client that keeps an older copy of
+    the cookie can still use the marker until it expires
+    """
+    if has_request_context():
+        session.pop(_session_key_prefix + form_name, None)
@@ -0,0 +1,162 @@
+"""
+Optional cache of rendered field html.  Fields created with cache_render=True are rendered
+through this cache, keyed by a fingerprint of everything that can affect their output, so a
+field that renders the same way on every request is only rendered once.
+
+Fingerprints only hold on to simple immutable values (strings, numbers, dates, enums etc.), so
+the cache can't keep request data such as models or uploaded files alive.  Other objects need
+a render_cache_key attribute - a stable value, i.e. a database id, that changes whenever the
+object would render differently - otherwise the field isn't cached.
+"""
+
+import datetime
+import decimal
+import enum
+import logging
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# Immutable types that compare by value.  These go into fingerprints as they are
+_VALUE_TYPES = (str, bytes, int, float, complex, type(None), decimal.Decimal, datetime.date,
+                datetime.time, datetime.timedelta, enum.Enum, type)
+
+# Field instance attributes that don't affect the rendered html
+_IGNORED_ATTRIBUTES = frozenset(['form', 'validators', 'cache_render', '_layout',
+                                 '_option_lists', 'submission'])
+
+
+class Uncacheable(Exception):
+    """Raised when a field's state can't be fingerprinted"""
+    pass
+
+
+def _freeze(value):
+    """
+    Convert a value into something hashable that will compare equal for values that render
+    the same.  The type is included so that, for example, 1 and True are kept apart
+    """
+    if isinstance(value, (list, tuple)):
+        return (value.__class__, tuple(_freeze(x) for x in value))
+
+    if isinstance(value, dict):
+        return (value.__class__, tuple((_freeze(k), _freeze(v)) for k, v in value.items()))
+
+    if hasattr(value, 'select_value') and hasattr(value, 'select_name'):
+        # Key pair - the value and name are what get rendered
+        return (value.__class__, _freeze(value.select_value), _freeze(value.select_name))
+
+    if isinstance(value, _VALUE_TYPES):
+        return (value.__class__, value)
+
+    # Anything else would be kept alive by the cache, and usually compares by identity, so is
+    # only cached if it provides a stable key
+    key = getattr(value, 'render_cache_key', None)
+    if key is None:
+        raise Uncacheable('Can\'t fingerprint value of type {}'.format(value.__class__.__name__))
+
+    return (value.__class__, _freeze(key))
+
+
+def get_render_cache_attributes(field_class):
+    """
+    Get all of the extra attributes that should be included in the fingerprint for a field
+    class, by combining render_cache_attributes from the class and all of its bases
+    """
+    attributes = field_class.__dict__.get('_all_render_cache_attributes')
+    if attributes is None:
+        attributes = []
+        for cls in reversed(field_class.__mro__):
+            for attribute in cls.__dict__.get('render_cache_attributes', ()):
+                if attribute not in attributes:
+                    attributes.append(attribute)
+
+        attributes = tuple(attributes)
+        field_class._all_render_cache_attributes = attributes
+
+    return attributes
+
+
+def fingerprint(field):
+    """
+    Create a hashable fingerprint of all of the render relevant state of a field.  This is made
+    up of the field's instance attributes, plus any attributes (usually properties that read
+    from the form) listed in render_cache_attributes on the field class and its bases
+    """
+    field_class = field.__class__
+
+    instance_state = tuple(
+        (name, _freeze(value)) for name, value in field.__dict__.items()
+        if name not in _IGNORED_ATTRIBUTES
+    )
+
+    extra_state = tuple(
+        _freeze(getattr(field, name)) for name in get_render_cache_attributes(field_class)
+    )
+
+    return (field_class, field.get_template_name(), instance_state, extra_state)
+
+
+class RenderCache(object):
+    """
+    Least recently used cache of rendered field html
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, field):
+        """Render a field, returning the cached html if this state has been rendered before"""
+        try:
+            key = fingerprint(field)
+        except Uncacheable as e:
+            log.debug('Not caching render of field \'%s\': %s' % (field.name, e))
+            self.uncacheable += 1
+            return Markup(field.render())
+
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+
+            self.misses += 1
+
+        html = Markup(field.render())
+
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+
+render_cache = RenderCache()
@@ -0,0 +1,257 @@
+"""
+Render plans for forms.  The output of form.html only depends on the "shape" of the form (the
+form attributes, how many fields and sections there are and where they go) so it is rendered
+once per shape with placeholders where the fields and CSRF token go.  The result is split into
+a list of steps which can be replayed to render any form with the same shape without going
+back through the form template.  Form sections are handled in the same way.
+"""
+
+import logging
+import asyncio
+import re
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup, escape
+
+from .env import get_template
+from .rendercache import render_cache
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# Step types
+TEXT = 'text'
+FIELD = 'field'
+CSRF = 'csrf'
+
+# Default minimum size of the chunks yielded when streaming
+DEFAULT_CHUNK_SIZE = 8192
+
+# Placeholders inserted into the template output when compiling a plan.  These use null
+# characters, which are never escaped and will never appear in real template output
+_FIELD_PLACEHOLDER = '\x00field:{}\x00'
+_CSRF_PLACEHOLDER = '\x00csrf\x00'
+_placeholder_re = re.compile('\x00(field:(\\d+)|csrf)\x00')
+
+
+def render_field(field):
+    """Render a single field as it would appear inside a form"""
+    if field.cache_render:
+        return render_cache.render(field)
+
+    return Markup(field.render())
+
+
+def stream_field(field):
+    """Render a single field as it would appear inside a form, as a generator of html fragments"""
+    if field.cache_render:
+        yield render_cache.render(field)
+    else:
+        yield from field.render_stream()
+
+
+async def render_field_async(field):
+    """Render a single field as it would appear inside a form, using the async environment"""
+    if field.cache_render:
+        return render_cache.render(field)
+
+    return Markup(await field.render_async())
+
+
+def buffer_chunks(fragments, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Join a stream of (usually very small) html fragments into chunks of at least chunk_size
+    characters
+    """
+    buffer = []
+    buffer_length = 0
+
+    for fragment in fragments:
+        buffer.append(fragment)
+        buffer_length += len(fragment)
+
+        if buffer_length >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            buffer_length = 0
+
+    if buffer:
+        yield ''.join(buffer)
+
+
+class RenderPlan(object):
+    def __init__(self, steps):
+        """
+        :param steps: List of (step type, value) tuples.  For TEXT steps the value is the html,
+                      for FIELD steps it's the index of the field in the list of fields passed
+                      in when rendering
+        """
+        self.steps = steps
+
+    def render(self, fields, generate_csrf_token=None):
+        parts = []
+
+        for step_type, value in self.steps:
+            if step_type == TEXT:
+                parts.append(value)
+            elif step_type == FIELD:
+                parts.append(render_field(fields[value]))
+            else:
+                parts.append(escape(generate_csrf_token()))
+
+        return Markup(''.join(parts))
+
+    async def render_async(self, fields, generate_csrf_token=None):
+        """
+        Like render, but renders the fields with the async environment.  Control is passed back
+        to the event loop between fields, so a large form doesn't hold up other tasks
+        """
+        parts = []
+
+        for step_type, value in self.steps:
+            if step_type == TEXT:
+                parts.append(value)
+            elif step_type == FIELD:
+                parts.append(await render_field_async(fields[value]))
+                await asyncio.sleep(0)
+            else:
+                parts.append(escape(generate_csrf_token()))
+
+        return Markup(''.join(parts))
+
+    def generate(self, fields, generate_csrf_token=None):
+        """Like render, but returns a generator of html fragments"""
+        for step_type, value in self.steps:
+            if step_type == TEXT:
+                yield value
+            elif step_type == FIELD:
+                yield from stream_field(fields[value])
+            else:
+                yield escape(generate_csrf_token())
+
+
+def compile_plan(template_name, fields, render_csrf=False, **context):
+    """
+    Render a template with placeholders in place of the fields and CSRF token, and split the
+    output into a RenderPlan.  The template must render fields with render_field(field)
+
+    :param template_name: The template to render
+    :param fields: List of all fields that may be rendered by the template
+    :param render_csrf: Whether or not a CSRF token will be rendered
+    :param context: Any other template variables
+    """
+    field_indexes = {id(field): i for i, field in enumerate(fields)}
+
+    def field_placeholder(field):
+        return Markup(_FIELD_PLACEHOLDER.format(field_indexes[id(field)]))
+
+    def csrf_placeholder():
+        return Markup(_CSRF_PLACEHOLDER)
+
+    html = get_template(template_name).render(
+        render_field=field_placeholder,
+        generate_csrf_token=csrf_placeholder if render_csrf else None,
+        **context
+    )
+
+    steps = []
+    position = 0
+    for match in _placeholder_re.finditer(html):
+        if match.start() > position:
+            steps.append((TEXT, html[position:match.start()]))
+
+        if match.group(2) is not None:
+            steps.append((FIELD, int(match.group(2))))
+        else:
+            steps.append((CSRF, None))
+
+        position = match.end()
+
+    if position < len(html):
+        steps.append((TEXT, html[position:]))
+
+    return RenderPlan(steps)
+
+
+def get_form_plan_key(form, render_csrf, render_flags):
+    """
+    Builds a hashable key containing everything that form.html reads, apart from the rendered
+    fields and the CSRF token
+    """
+    return (
+        'form',
+        render_flags,
+        render_csrf,
+        form.action,
+        form.method,
+        form.css_class,
+        form.multipart,
+        form.id,
+        form.max_width,
+        form.submitted_hidden_input_name,
+        tuple(field.render_after_sections for field in form.fields),
+        tuple((section.name, len(section.fields)) for section in form.sections)
+    )
+
+
+class RenderPlanCache(object):
+    """
+    Least recently used cache of compiled render plans, keyed by form (or section) shape
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_form_plan(self, form, render_csrf, render_flags):
+        """
+        :param form: The form to get a plan for
+        :param render_csrf: Whether or not the CSRF token will be rendered
+        :param render_flags: Tuple of (name, value) tuples with the render_* template flags
+        """
+        key = get_form_plan_key(form, render_csrf, render_flags)
+
+        return self._get_plan(key, lambda: compile_plan('form.html', form.all_fields, render_csrf,
+                                                        form=form, **dict(render_flags)))
+
+    def get_section_plan(self, section):
+        key = ('section', len(section.fields))
+
+        return self._get_plan(key, lambda: compile_plan('form_section.html', section.fields,
+                                                        section=section))
+
+    def _get_plan(self, key, compile_function):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+
+            self.misses += 1
+
+        plan = compile_function()
+
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def size(self):
+        return len(self._plans)
+
+
+plan_cache = RenderPlanCache()
@@ -0,0 +1,166 @@
+"""
+Declarative form schemas.  Instead of building a form from scratch on every request, declare the
+fields once as class attributes:
+
+    class ContactForm(FormSchema):
+        form_options = {'form_type': formtype.HORIZONTAL}
+
+        name = TextField('name', required=True)
+        email = EmailField('email')
+
+        class Address(FormSchemaSection):
+            line1 = TextField('line1')
+            postcode = PostcodeField('postcode')
+
+The schema is checked when the class is created, and each instance of the class is a Form
+containing cheap copies of the declared fields
+"""
+
+import logging
+
+from . import exceptions
+from . import styles
+from .form import Field, Form
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+
+class FormSchemaSection(object):
+    """
+    Declares a section of a FormSchema.  Subclass this inside the schema, and declare the
+    section's fields as class attributes.  The section is named after the class unless name
+    is set
+    """
+    name = None
+
+
+# Names that can't be used for fields, because the form already uses them
+_reserved_attributes = None
+
+
+def _get_reserved_attributes():
+    global _reserved_attributes
+
+    if _reserved_attributes is None:
+        _reserved_attributes = frozenset(dir(Form)) | frozenset(vars(Form(read_form_data=False)))
+
+    return _reserved_attributes
+
+
+def _get_declared_fields(attrs):
+    """Get (attribute name, field) for each field declared in a class body, in order"""
+    return [(key, value) for key, value in attrs.items() if isinstance(value, Field)]
+
+
+def _check_duplicates(fields, schema_name):
+    seen = {}
+    for field in fields:
+        existing = seen.get(field.name)
+        if existing is not None and not (field.allow_duplicates and existing.allow_duplicates):
+            raise exceptions.DuplicateField('A field named "{}" is declared more than once in '
+                                            '{}'.format(field.name, schema_name))
+
+        seen[field.name] = field
+
+
+class FormSchemaMeta(type):
+    """Collects and checks the declared fields and sections when a schema class is created"""
+    def __init__(cls, name, bases, attrs):
+        super().__init__(name, bases, attrs)
+
+        # Start with anything declared on the base schemas
+        fields = []
+        sections = []
+        for base in reversed(cls.__mro__[1:]):
+            fields.extend(base.__dict__.get('_schema_fields', ()))
+            sections.extend(base.__dict__.get('_schema_sections', ()))
+
+        attribute_names = set(attribute for attribute, field in fields)
+        for section_name, section_fields in sections:
+            attribute_names.update(attribute for attribute, field in section_fields)
+
+        def add_attribute(attribute):
+            if attribute in attribute_names:
+                raise exceptions.InvalidSchema('{} declares "{}" more than once'.format(
+                    name, attribute
+                ))
+            if attribute in _get_reserved_attributes():
+                raise exceptions.InvalidSchema('{}.{} clashes with an attribute of Form'.format(
+                    name, attribute
+                ))
+
+            attribute_names.add(attribute)
+
+        for attribute, field in _get_declared_fields(attrs):
+            add_attribute(attribute)
+            fields.append((attribute, field))
+            # The instance gets its own copy of the field
+            delattr(cls, attribute)
+
+        for attribute, value in list(attrs.items()):
+            if isinstance(value, type) and issubclass(value, FormSchemaSection):
+                section_name = value.name if value.name is not None else attribute
+                section_fields = _get_declared_fields(vars(value))
+                for field_attribute, field in section_fields:
+                    add_attribute(field_attribute)
+
+                sections.append((section_name, tuple(section_fields)))
+
+        section_names = [section_name for section_name, section_fields in sections]
+        if len(set(section_names)) != len(section_names):
+            raise exceptions.InvalidSchema('{} declares sections with the same name'.format(name))
+
+        all_fields = [field for attribute, field in fields]
+        for section_name, section_fields in sections:
+            all_fields.extend(field for attribute, field in section_fields)
+
+        _check_duplicates(all_fields, name)
+
+        options = cls.form_options
+        if options.get('method', 'POST') not in ('POST', 'GET'):
+            raise ValueError('Invalid method in {}: {}'.format(name, options['method']))
+        if options.get('style', styles.BOOTSTRAP_3) not in styles.ALL_STYLES:
+            raise ValueError('Invalid style in {}: {}'.format(name, options['style']))
+
+        cls._schema_fields = tuple(fields)
+        cls._schema_sections = tuple(sections)
+
+
+class FormSchema(Form, metaclass=FormSchemaMeta):
+    """
+    Base class for declarative forms.  Fields declared as class attributes are copied into each
+    instance, and are also available as attributes of the instance (i.e. form.email.value)
+    """
+    # Default keyword arguments passed to Form.__init__
+    form_options = {}
+
+    def __init__(self, read_form_data=True, **kwargs):
+        """
+        :param read_form_data: If True (by default) automatically parses the form input from the
+                               current request
+        :param kwargs: Any other Form arguments.  These override form_options
+        """
+        options = dict(self.form_options)
+        options.update(kwargs)
+
+        fields = []
+        for attribute, prototype in self._schema_fields:
+            field = prototype.clone()
+            setattr(self, attribute, field)
+            fields.append(field)
+
+        super().__init__(fields, read_form_data=False, **options)
+
+        for section_name, section_fields in self._schema_sections:
+            fields = []
+            for attribute, prototype in section_fields:
+                field = prototype.clone()
+                setattr(self, attribute, field)
+                fields.append(field)
+
+            self.add_section(section_name, fields)
+
+        if read_form_data:
+            self.read_form_data()
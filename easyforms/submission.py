@@ -0,0 +1,65 @@
+"""
+The data submitted with a form.  Forms are processed from a Submission rather than reading
+flask's request directly, so that form data can be validated anywhere, i.e. in a worker thread,
+a background job or a different web framework
+"""
+
+import logging
+
+from flask import request, has_request_context
+from werkzeug.datastructures import MultiDict
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+
+def _to_multi_dict(data):
+    if data is None:
+        return MultiDict()
+
+    if hasattr(data, 'getlist'):
+        return data
+
+    return MultiDict(data)
+
+
+class Submission(object):
+    """
+    Everything the fields need from a submitted form
+
+    :param data: The submitted values.  A MultiDict, or a dictionary which will be converted to
+                 one (lists of values become multiple values)
+    :param files: The uploaded files, keyed by field name.  Same format as data, with
+                  FileStorage objects (or anything with a filename and read()) as the values
+    :param remote_addr: The ip address of the client, used by the recaptcha field
+    :param method: The HTTP method the form was submitted with
+    """
+    def __init__(self, data=None, files=None, remote_addr=None, method='POST'):
+        self.data = _to_multi_dict(data)
+        self.files = _to_multi_dict(files)
+        self.remote_addr = remote_addr
+        self.method = method
+
+    @classmethod
+    def from_request(cls):
+        """Create a submission from the current flask request"""
+        if request.method == 'POST':
+            data = request.form
+            files = request.files
+        else:
+            data = request.args
+            files = None
+
+        return cls(data, files=files, remote_addr=request.remote_addr, method=request.method)
+
+    @classmethod
+    def from_current_request(cls):
+        """
+        Create a submission from the current flask request if there is one, otherwise return
+        an empty submission
+        """
+        if has_request_context():
+            return cls.from_request()
+
+        return cls()
@@ -0,0 +1,174 @@
+"""
+Destinations for uploaded files.  A FileUploadField with a sink copies the upload into the sink
+in chunks, stopping as soon as the upload is larger than the field allows.
+
+This happens after werkzeug has parsed the request, so the whole upload has already been
+received (and spooled to a temporary file if it's large) by the time it's copied.  max_bytes
+saves copying and storing oversized files, but it doesn't stop them being sent - use flask's
+MAX_CONTENT_LENGTH to limit the size of the whole request
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+
+from .exceptions import FileTooLarge
+
+__author__ = 'Stephen Brown (Little Fish Solutions LTD)'
+
+log = logging.getLogger(__name__)
+
+# The number of bytes copied at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class MemorySink(object):
+    """Keep the upload in memory.  The field value is the uploaded bytes"""
+    def open(self, filename):
+        return io.BytesIO()
+
+    def finish(self, fileobj, filename):
+        return fileobj.getvalue()
+
+    def discard(self, fileobj):
+        fileobj.close()
+
+
+class SpooledSink(object):
+    """
+    Keep small uploads in memory and move larger ones into a temporary file.  The field value is
+    the file object, positioned at the start
+
+    :param max_memory: The largest upload, in bytes, to keep in memory
+    """
+    def __init__(self, max_memory=1024 * 1024):
+        self.max_memory = max_memory
+
+    def open(self, filename):
+        return tempfile.SpooledTemporaryFile(max_size=self.max_memory)
+
+    def finish(self, fileobj, filename):
+        fileobj.seek(0)
+        return fileobj
+
+    def discard(self, fileobj):
+        fileobj.close()
+
+
+class DirectorySink(object):
+    """
+    Write uploads straight into a directory, under a random name.  The field value is the path
+    of the new file.  The application is responsible for moving or deleting it
+
+    :param directory: The directory to write to.  Must be on the same filesystem as the final
+                      destination if you want to move the file without copying it
+    :param suffix: Added to the end of the random file name, i.e. '.upload'
+    """
+    def __init__(self, directory, suffix=''):
+        self.directory = directory
+        self.suffix = suffix
+
+    def open(self, filename):
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=self.suffix, delete=False)
+
+    def finish(self, fileobj, filename):
+        fileobj.close()
+        return fileobj.name
+
+    def discard(self, fileobj):
+        fileobj.close()
+        try:
+            os.remove(fileobj.name)
+        except OSError:
+            log.warning('Failed to remove discarded upload {}'.format(fileobj.name))
+
+
+def format_size(num_bytes):
+    """Format a number of bytes for an error message, i.e. 2.5 MB"""
+    for units in ('bytes', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return '{:g} {}'.format(round(num_bytes, 1), units)
+        num_bytes /= 1024
+
+    return '{:g} GB'.format(round(num_bytes, 1))
+
+
+def get_stream_size(stream):
+    """
+    Get the number of bytes remaining in a stream without reading it, or None if the stream
+    can't seek
+    """
+    try:
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - position
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def hash_stream(stream, hash_algorithm):
+    """
+    Hash the contents of a seekable stream, a chunk at a time, leaving it where it was
+
+    :return: The hex digest
+    """
+    digest = hashlib.new(hash_algorithm)
+    position = stream.tell()
+    try:
+        stream.seek(0)
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        stream.seek(position)
+
+    return digest.hexdigest()
+
+
+def copy_upload(stream, sink, filename, max_bytes=None, hash_algorithm=None):
+    """
+    Copy an uploaded file into a sink.  The stream is the file werkzeug has already parsed out
+    of the request, so this limits what is copied rather than what is received
+
+    :param stream: The uploaded file stream
+    :param sink: Where to copy it to
+    :param filename: The uploaded file name
+    :param max_bytes: If set, raise FileTooLarge as soon as more than this many bytes have
+                      been seen.  Seekable streams are checked before anything is copied
+    :param hash_algorithm: If set, the name of a hashlib algorithm used to hash the contents as
+                           they are copied
+    :return: (value from the sink, size in bytes, hex digest or None)
+    """
+    if max_bytes is not None:
+        size = get_stream_size(stream)
+        if size is not None and size > max_bytes:
+            raise FileTooLarge(size)
+
+    digest = hashlib.new(hash_algorithm) if hash_algorithm else None
+
+    fileobj = sink.open(filename)
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise FileTooLarge(size)
+
+            if digest is not None:
+                digest.update(chunk)
+            fileobj.write(chunk)
+    except BaseException:
+        sink.discard(fileobj)
+        raise
+
+    value = sink.finish(fileobj, filename)
+    return value, size, digest.hexdigest() if digest is not None else None
@@ -656,3 +656,1099 @@ def test_get_if_present(app):
         assert form.get_if_present('field6', 'bananas') == 'bananas'
         assert form.get_if_present('field7', 12) == 12
 
+
+def test_production_mode(app):
+    form = Form([
+        forms.TextField('text'),
+        forms.SelectField('select', [])
+    ], read_form_data=False)
+
+    development_html = form.render()
+
+    forms.init_production_mode()
+    try:
+        assert forms.template_cache.enabled
+        assert forms.template_cache.size > 0
+
+        forms.template_cache.reset_stats()
+        assert form.render() == development_html
+        form.render()
+
+        assert forms.template_cache.misses == 0
+        assert forms.template_cache.hits > 0
+    finally:
+        forms.init_production_mode(False)
+
+    assert forms.template_cache.enabled is False
+    assert forms.template_cache.size == 0
+
+
+def test_render_plan(app):
+    def create_form():
+        form = Form([forms.TextField('text')], read_form_data=False)
+        form.add_section('section', [forms.IntegerField('integer')])
+        return form
+
+    forms.renderplan.plan_cache.clear()
+
+    html = create_form().render()
+    assert forms.renderplan.plan_cache.misses == 1
+
+    assert create_form().render() == html
+    assert forms.renderplan.plan_cache.hits == 1
+    assert forms.renderplan.plan_cache.size == 1
+
+    form = create_form()
+    form.add_section('another-section', [forms.TextField('more-text')])
+    assert 'more-text' in form.render()
+    assert forms.renderplan.plan_cache.size == 2
+
+    assert 'more-text' in form.render_sections()
+    assert 'more-text' not in form.render_before_sections()
+
+
+def test_render_cache(app):
+    cache = forms.rendercache.render_cache
+    cache.clear()
+
+    def create_form(value='a', cache_render=True):
+        return Form([
+            forms.HiddenField('hidden', value, cache_render=cache_render),
+            forms.TextField('text')
+        ], read_form_data=False)
+
+    html = create_form().render()
+    assert cache.misses == 1
+    assert cache.hits == 0
+
+    assert create_form().render() == html
+    assert cache.hits == 1
+
+    # Changing the value or the form style changes the fingerprint
+    assert create_form(value='b').render() != html
+    assert cache.misses == 2
+
+    form = create_form()
+    form.style = forms.styles.BOOTSTRAP_4
+    form.render()
+    assert cache.misses == 3
+
+    # Fields that don't opt in are never cached
+    create_form(cache_render=False).render()
+    assert cache.misses == 3
+    assert cache.size == 3
+
+    cache.max_size = 2
+    try:
+        create_form(value='c').render()
+        assert cache.size == 2
+        assert cache.evictions == 2
+    finally:
+        cache.max_size = 1024
+        cache.clear()
+
+
+def test_render_cache_attributes(app):
+    external_state = {'suffix': 'one'}
+
+    class SuffixField(forms.HiddenField):
+        render_cache_attributes = ('suffix', )
+
+        @property
+        def suffix(self):
+            return external_state['suffix']
+
+        def render(self):
+            return super().render() + self.suffix
+
+    assert 'suffix' in forms.rendercache.get_render_cache_attributes(SuffixField)
+    assert 'style' in forms.rendercache.get_render_cache_attributes(SuffixField)
+
+    form = Form([SuffixField('field', 'value', cache_render=True)], read_form_data=False)
+    assert form.render_field('field').endswith('one')
+
+    external_state['suffix'] = 'two'
+    assert form.render_field('field').endswith('two')
+
+    forms.rendercache.render_cache.clear()
+
+
+def test_render_cache_objects(app):
+    import gc
+    import weakref
+
+    cache = forms.rendercache.render_cache
+    cache.clear()
+
+    class Model(object):
+        def __init__(self, id):
+            self.id = id
+
+        def __str__(self):
+            return 'model {}'.format(self.id)
+
+    class KeyedModel(Model):
+        @property
+        def render_cache_key(self):
+            return self.id
+
+    # Objects without a key aren't cached, so the cache doesn't keep them alive
+    model = Model(1)
+    ref = weakref.ref(model)
+    Form([forms.HiddenField('model', model, cache_render=True)], read_form_data=False).render()
+    assert cache.uncacheable == 1
+    assert cache.size == 0
+    del model
+    gc.collect()
+    assert ref() is None
+
+    # Objects with a key are cached by the key
+    for i in range(2):
+        Form([forms.HiddenField('model', KeyedModel(1), cache_render=True)], read_form_data=False).render()
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+    cache.clear()
+
+
+def test_render_stream(app):
+    form = Form([
+        forms.TextField('text'),
+        forms.SelectField('select', [])
+    ], read_form_data=False)
+    form.add_section('section', [forms.IntegerField('integer'), forms.TextAreaField('text-area')])
+
+    chunks = list(form.render_stream(chunk_size=100))
+    assert len(chunks) > 1
+    for chunk in chunks[:-1]:
+        assert len(chunk) >= 100
+    assert ''.join(chunks) == form.render()
+
+    assert ''.join(form.render_section_stream('section')) == form.render_section('section')
+    assert ''.join(form.render_field_stream('text')) == form.render_field('text')
+
+
+def test_render_async(app):
+    import asyncio
+
+    class KeyPair(object):
+        def __init__(self, value):
+            self.select_value = value
+            self.select_name = value.title()
+
+    async def load_options():
+        for value in ['one', 'two', 'three']:
+            await asyncio.sleep(0)
+            yield KeyPair(value)
+
+    form = Form([
+        forms.TextField('text'),
+        forms.SelectField('select', [KeyPair('one'), KeyPair('two'), KeyPair('three')])
+    ], read_form_data=False)
+    form.add_section('section', [forms.IntegerField('integer')])
+
+    assert asyncio.run(form.render_async()) == form.render()
+    assert asyncio.run(form.get_section('section').render_async()) == form.render_section('section')
+
+    async_field = forms.SelectField('async-select', load_options())
+    Form([async_field], read_form_data=False)
+    assert 'Three' in asyncio.run(async_field.render_async())
+
+
+def test_layout(app):
+    field1 = Field('field1')
+    field2 = Field('field2')
+    form = Form([field1, field2], read_form_data=False)
+
+    # Fields with the same configuration share a layout
+    assert field1.layout is field2.layout
+
+    field1.error = 'Invalid'
+    assert field1.layout is not field2.layout
+    assert 'has-error' in field1.form_group_classes
+    assert 'has-error' not in field2.form_group_classes
+
+    # Layout changes are picked up outside of a render
+    form.label_width = 4
+    assert field2.input_no_label_column_class == 'col-sm-offset-4 col-sm-9'
+
+    # The snapshot only lives for the duration of a render
+    field3 = forms.TextField('field3')
+    form.add_field(field3)
+    assert 'col-sm-offset-4' not in field3.render()
+    assert field3._layout is None
+
+    # Subclasses that override a layout property still get it in the attributes built from it
+    class WideField(forms.TextField):
+        @property
+        def input_column_class(self):
+            return 'col-wide'
+
+        @property
+        def form_group_style(self):
+            return 'color: red'
+
+    field4 = WideField('field4')
+    form.add_field(field4)
+    assert field4.input_column_attributes == 'class="col-wide"'
+    assert field4.input_column_no_label_attributes == 'class="col-wide col-sm-offset-4"'
+    assert field4.form_group_attributes == 'class="form-group" style="color: red"'
+    html = field4.render()
+    assert 'class="col-wide"' in html
+    assert 'style="color: red"' in html
+
+
+def test_option_list(app):
+    class KeyPair(object):
+        def __init__(self, value):
+            self.select_value = value
+            self.select_name = '<{}>'.format(value)
+
+    key_pairs = [KeyPair('a'), KeyPair('b'), KeyPair('c')]
+
+    select = forms.SelectField('select', key_pairs, value='b')
+    objects = forms.ObjectListSelectField('objects', key_pairs, value=key_pairs[2])
+    radios = forms.RadiosField('radios', key_pairs, value='a')
+    Form([select, objects, radios], read_form_data=False)
+
+    html = select.render()
+    assert '<option value="b" selected="selected">&lt;b&gt;</option>' in html
+    assert html.count('selected="selected"') == 1
+    assert '<option value="c" selected="selected">' in objects.render()
+    assert 'id="radios-0" value="a" class="form-check-input" checked>' in radios.render()
+
+    # Fields with the same options share the prerendered html
+    assert select.get_option_list()[0] is objects.get_option_list()[0]
+
+    # Assigning new key pairs rebuilds the options
+    select.key_pairs = [KeyPair('d')]
+    assert 'value="a"' not in select.render()
+    assert 'value="d"' in select.render()
+
+
+def test_select_conversion(app):
+    import enum
+    from werkzeug.datastructures import MultiDict
+
+    class Colour(enum.Enum):
+        RED = 'red'
+        BLUE = 'blue'
+
+    class KeyPair(object):
+        def __init__(self, value):
+            self.select_value = value
+            self.select_name = str(value)
+
+    key_pairs = [KeyPair(i) for i in range(100)]
+
+    with app.test_request_context('/', method='POST', data=MultiDict([
+            (Form.SUBMITTED_HIDDEN_INPUT_NAME, '1'),
+            ('select', 'b'),
+            ('objects', '42'),
+            ('colour', 'blue'),
+            ('checkboxes', '3'),
+            ('checkboxes', '5')])):
+
+        form = Form([
+            forms.ListSelectField('select', ['a', 'b']),
+            forms.ObjectListSelectField('objects', key_pairs),
+            forms.EnumSelectField('colour', Colour),
+            forms.MultiCheckboxField('checkboxes', [KeyPair(str(i)) for i in range(10)])
+        ])
+
+        assert form.ready
+        assert form['select'] == 'b'
+        assert form['objects'] is key_pairs[42]
+        assert form['colour'] is Colour.BLUE
+        assert [v.select_value for v in form['checkboxes']] == ['3', '5']
+
+    # Unhashable select values still work, they are just compared one by one
+    values = [KeyPair(['a']), KeyPair(['b'])]
+    field = forms.MultiCheckboxField('checkboxes', values, value=[values[1]])
+    Form([field], read_form_data=False)
+    inputs = field.render().split('<input')[1:]
+    assert ['checked' in html for html in inputs] == [False, True]
+
+    field.extract_value(MultiDict([('checkboxes', "['a']")]))
+    assert field.value == []
+
+
+def test_date_select_options(app):
+    import datetime
+
+    this_year = datetime.datetime.now().year
+    date_select = forms.DateSelectField('date', value=datetime.date(this_year - 20, 2, 3))
+    year_month = forms.YearMonthSelectField('year-month', years=[2001, 2000])
+    Form([date_select, year_month], read_form_data=False)
+
+    html = date_select.render()
+    assert '<option value="3" selected="selected">3</option>' in html
+    assert '<option value="2" selected="selected">February</option>' in html
+    assert '<option value="{0}" selected="selected">{0}</option>'.format(this_year - 20) in html
+    assert 'selected="selected"' not in year_month.render()
+
+    # years is still a list, but fields with the same years share the prerendered options
+    other = forms.DateSelectField('other')
+    assert isinstance(other.years, list)
+    assert forms.options.get_year_options(other.years) is forms.options.get_year_options(date_select.years)
+
+    with app.test_request_context('/', method='POST', data={
+            Form.SUBMITTED_HIDDEN_INPUT_NAME: '1',
+            'date-day': '1',
+            'date-month': '1',
+            'date-year': str(this_year - 200),
+            'year-month-month': '6',
+            'year-month-year': '2001'}):
+
+        form = Form([forms.DateSelectField('date'), forms.YearMonthSelectField('year-month', years=[2001])])
+        assert form.get_error('date') == 'Invalid year'
+        assert form['year-month'] == datetime.date(2001, 6, 1)
+
+
+def test_db_option_cache(app):
+    class Country(object):
+        name = None
+        loads = 0
+
+        def __init__(self, code, name):
+            self.code = code
+            self.name = name
+            self.select_value = code
+            self.select_name = name
+
+        class query(object):
+            @staticmethod
+            def order_by(column):
+                return Country.query
+
+            @staticmethod
+            def all():
+                Country.loads += 1
+                return [Country('GB', 'United Kingdom'), Country('FR', 'France')]
+
+    cache = forms.dbfields.init_option_cache(default_ttl=60, listen_for_changes=False)
+    try:
+        # Options are only loaded when they are needed
+        field = forms.DbCodeSelectField('country', Country)
+        assert Country.loads == 0
+
+        Form([field], read_form_data=False)
+        assert 'United Kingdom' in field.render()
+        assert Country.loads == 1
+
+        field = forms.DbCodeSelectField('country', Country, value=Country('FR', 'France'))
+        Form([field], read_form_data=False)
+        assert '<option value="FR" selected="selected">France</option>' in field.render()
+        assert Country.loads == 1
+
+        cache.invalidate(Country)
+        field = forms.DbCodeSelectField('country', Country)
+        Form([field], read_form_data=False)
+        field.render()
+        assert Country.loads == 2
+    finally:
+        forms.dbfields.set_option_cache(None)
+
+
+def test_db_select_preloaded_values(app):
+    class Country(object):
+        class query(object):
+            @staticmethod
+            def filter(condition):
+                raise AssertionError('Preloaded values should not be queried')
+
+        def __init__(self, id, code):
+            self.id = id
+            self.code = code
+            self.select_value = code
+            self.select_name = code
+
+    countries = [Country(1, 'GB'), Country(2, 'FR')]
+
+    with app.test_request_context('/', method='POST', data={
+            Form.SUBMITTED_HIDDEN_INPUT_NAME: '1',
+            'by-code': 'FR',
+            'by-id': '1',
+            'invalid': '3'}):
+
+        form = Form([
+            forms.DbCodeSelectField('by-code', Country, values=countries),
+            forms.DbIdSelectField('by-id', Country, values=countries),
+            forms.DbIdSelectField('invalid', Country, values=countries)
+        ])
+
+        assert form['by-code'] is countries[1]
+        assert form['by-id'] is countries[0]
+        assert form.get_error('invalid') == 'Invalid selection'
+
+        # The valid values are still available as lists
+        assert form.get_field('by-code').valid_codes == ['GB', 'FR']
+        assert form.get_field('by-id').valid_ids == [1, 2]
+
+
+def test_form_schema(app):
+    class ContactForm(forms.FormSchema):
+        form_options = {'submit_text': 'Send'}
+
+        name = forms.TextField('name', required=True)
+        email = forms.EmailField('email')
+
+        class Address(forms.FormSchemaSection):
+            postcode = forms.TextField('postcode')
+
+    # Fields are copied into each instance
+    assert not hasattr(ContactForm, 'email')
+    form1 = ContactForm(read_form_data=False)
+    form2 = ContactForm(read_form_data=False)
+    assert form1.email is not form2.email
+    assert form1.email.form is form1
+    assert form1.get_section('Address').fields == [form1.postcode]
+    assert 'Send' in form1.render()
+
+    with app.test_request_context('/', method='POST', data={
+            Form.SUBMITTED_HIDDEN_INPUT_NAME: '1',
+            'name': 'Bob',
+            'email': 'bob@example.com',
+            'postcode': 'AB1 2CD'}):
+
+        form = ContactForm()
+        assert form.ready
+        assert form.name.value == 'Bob'
+        assert form['postcode'] == 'AB1 2CD'
+
+    # Invalid schemas are caught when the class is created
+    with pytest.raises(forms.exceptions.DuplicateField):
+        class DuplicateForm(forms.FormSchema):
+            one = forms.TextField('text')
+            two = forms.TextField('text')
+
+    with pytest.raises(forms.exceptions.InvalidSchema):
+        class ClashingForm(forms.FormSchema):
+            action = forms.TextField('action')
+
+
+def test_field_spec():
+    field1 = forms.TextField('field1', width=6)
+    field2 = forms.TextField('field2', width=6)
+
+    # Fields with the same options share a spec
+    assert field1._spec is field2._spec
+
+    # Changing an option only affects that field
+    field1.width = 4
+    assert field1.width == 4
+    assert field2.width == 6
+    assert field1._spec is not field2._spec
+
+    field1.width = 6
+    assert field1._spec is field2._spec
+
+    assert forms.TextField('field3', max_width=100).max_width == '100px'
+
+
+def test_validate_many(app):
+    import datetime
+
+    form = Form([
+        forms.TextField('name', required=True),
+        forms.IntegerField('age'),
+        forms.ListSelectField('colour', ['red', 'blue'])
+    ], read_form_data=False)
+    form.set_value('name', 'Original')
+
+    records = [
+        {'name': 'Alice', 'age': '30', 'colour': 'red'},
+        {'name': '', 'age': 'old', 'colour': 'green'},
+        {'name': 'Bob', 'age': '', 'colour': 'blue'}
+    ]
+
+    results = form.validate_many(records)
+    assert [result.valid for result in results] == [True, False, True]
+    assert results[0].values['age'] == 30
+    assert set(results[1].errors) == {'name', 'age', 'colour'}
+    assert results[2].values['age'] is None
+
+    # The form is left as it was
+    assert form.get_field('name').value == 'Original'
+    assert not form.has_errors
+
+    results = form.validate_many(records, fail_fast=True)
+    assert len(results) == 2
+    assert not results[1].valid
+
+    assert form.validate_many([{'name': 'Alice'}])[0].errors == {'age': 'Missing', 'colour': 'Missing'}
+
+    # Fields with several inputs report missing ones too, and nothing leaks between records
+    form = Form([forms.DateSelectField('dob', required=True)], read_form_data=False)
+    results = form.validate_many([
+        {'dob-day': '1', 'dob-month': '2', 'dob-year': '2000'},
+        {'dob-day': '1', 'dob-month': '2'},
+        {'dob-day': '', 'dob-month': '', 'dob-year': ''}
+    ])
+    assert results[0].values['dob'] == datetime.date(2000, 2, 1)
+    assert results[1].errors == {'dob': 'Missing'}
+    assert results[2].errors == {'dob': 'Required'}
+
+
+def test_process_submission():
+    import io
+    from werkzeug.datastructures import FileStorage
+
+    form = Form([
+        forms.TextField('text'),
+        forms.FileUploadField('upload', accept='text/plain')
+    ], read_form_data=False)
+
+    # No flask request is needed
+    form.process(forms.Submission(
+        {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1', 'text': 'hello'},
+        files={'upload': FileStorage(io.BytesIO(b'file contents'), filename='test.txt')},
+        remote_addr='127.0.0.1'
+    ))
+
+    assert form.ready
+    assert form['text'] == 'hello'
+    assert form['upload'] == b'file contents'
+    assert form.get_field('upload').filename == 'test.txt'
+
+    # Submissions with a different method are ignored
+    form = Form([forms.TextField('text')], read_form_data=False)
+    form.process(forms.Submission({Form.SUBMITTED_HIDDEN_INPUT_NAME: '1'}, method='GET'))
+    assert not form.submitted
+
+
+def test_heavy_field_executor():
+    data = {
+        Form.SUBMITTED_HIDDEN_INPUT_NAME: '1',
+        'text': 'hello',
+        'html1': '<p>one&nbsp;</p><p> </p>',
+        'html2': '<p>two</p>'
+    }
+
+    def process():
+        form = Form([
+            forms.CkeditorField('html1', required=True),
+            forms.TextField('text'),
+            forms.CkeditorField('html2')
+        ], read_form_data=False)
+        form.process(forms.Submission(data))
+        return form
+
+    expected = process()
+
+    forms.init_heavy_field_executor(max_workers=2)
+    try:
+        form = process()
+    finally:
+        forms.set_heavy_field_executor(None)
+
+    assert form.ready
+    for name in ['html1', 'text', 'html2']:
+        assert form[name] == expected[name]
+
+
+def test_heavy_field_executor_failure():
+    import time
+
+    class SlowField(forms.TextField):
+        heavy = True
+        finished = False
+
+        def extract_value(self, data):
+            time.sleep(0.2)
+            super().extract_value(data)
+            self.finished = True
+
+    class BrokenField(forms.TextField):
+        def extract_value(self, data):
+            raise RuntimeError('Broken')
+
+    forms.init_heavy_field_executor(max_workers=1)
+    try:
+        slow = SlowField('slow')
+        form = Form([slow, BrokenField('broken')], read_form_data=False)
+        with pytest.raises(RuntimeError):
+            form.process(forms.Submission({Form.SUBMITTED_HIDDEN_INPUT_NAME: '1', 'slow': 'x'}))
+
+        # The heavy field isn't left running after the error
+        assert slow.finished
+    finally:
+        forms.set_heavy_field_executor(None)
+
+
+def test_heavy_field_validators_use_request_context(app):
+    import threading
+    from flask import g
+
+    def check_thread(value):
+        # Validators can use flask globals, as they run on the request thread
+        if g.request_thread is not threading.current_thread():
+            return 'Validated on the wrong thread'
+
+    forms.init_heavy_field_executor(max_workers=2)
+    try:
+        with app.test_request_context():
+            g.request_thread = threading.current_thread()
+            form = Form([forms.CkeditorField('html', validators=[check_thread])],
+                        read_form_data=False)
+            form.process(forms.Submission({Form.SUBMITTED_HIDDEN_INPUT_NAME: '1',
+                                           'html': '<p>hello</p>'}))
+    finally:
+        forms.set_heavy_field_executor(None)
+
+    assert form.ready
+
+
+def test_image_upload_header_only():
+    import io
+    from PIL import Image
+    from werkzeug.datastructures import FileStorage
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (120, 80), 'red').save(buffer, 'PNG')
+    image_bytes = buffer.getvalue()
+
+    def process(**kwargs):
+        field = forms.ImageUploadField('image', header_only=True, **kwargs)
+        form = Form([field], read_form_data=False)
+        form.process(forms.Submission(
+            {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1'},
+            files={'image': FileStorage(io.BytesIO(image_bytes), filename='red.png')}
+        ))
+        return field
+
+    field = process(min_image_width=100)
+    assert field.error is None
+    assert field.value.size == (120, 80)
+    assert field.raw_image_data == image_bytes
+    assert field.value.getpixel((0, 0)) == (255, 0, 0)
+
+    field = process(min_image_width=200)
+    assert field.error == 'Image must be at least 200 pixels wide. '
+    assert field.value is None
+
+
+def test_file_upload_sink(tmpdir):
+    import hashlib
+    import io
+    import os
+    from werkzeug.datastructures import FileStorage
+
+    contents = b'x' * 200000
+
+    def process(**kwargs):
+        field = forms.FileUploadField('upload', accept='*', **kwargs)
+        form = Form([field], read_form_data=False)
+        form.process(forms.Submission(
+            {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1'},
+            files={'upload': FileStorage(io.BytesIO(contents), filename='big.bin')}
+        ))
+        return field
+
+    field = process(max_bytes=100000)
+    assert field.error == 'File is too large.  The maximum size is 97.7 KB'
+    assert field.value is None
+
+    field = process(max_bytes=300000, hash_algorithm='sha256')
+    assert field.value == contents
+    assert field.size == len(contents)
+    assert field.digest == hashlib.sha256(contents).hexdigest()
+
+    field = process(sink=forms.uploads.DirectorySink(str(tmpdir)))
+    assert os.path.dirname(field.value) == str(tmpdir)
+    with open(field.value, 'rb') as f:
+        assert f.read() == contents
+
+    # Non-seekable streams are stopped as soon as they go over the limit
+    class Stream(object):
+        def __init__(self):
+            self.stream = io.BytesIO(contents)
+            self.read_bytes = 0
+
+        def read(self, size):
+            data = self.stream.read(size)
+            self.read_bytes += len(data)
+            return data
+
+    stream = Stream()
+    with pytest.raises(forms.exceptions.FileTooLarge):
+        forms.uploads.copy_upload(stream, forms.uploads.MemorySink(), 'big.bin', max_bytes=1000)
+    assert stream.read_bytes == forms.uploads.CHUNK_SIZE
+
+
+def test_chunked_upload(tmpdir):
+    import io
+    from PIL import Image
+    from werkzeug.test import Client
+
+    flask_app = create_test_app()
+    flask_app.config['TESTING'] = True
+    access = {'allowed': False}
+    store = forms.chunkedupload.init_chunked_uploads(
+        flask_app, str(tmpdir), check_access=lambda: access['allowed'], max_chunk_bytes=1000,
+        max_upload_bytes=5000, max_pending_bytes=6000
+    )
+    client = Client(flask_app)
+
+    try:
+        contents = bytes(range(256)) * 10
+
+        assert client.post('/easyforms/upload/start', json={
+            'filename': 'data.bin', 'size': len(contents), 'chunk_count': 3
+        }).status_code == 403
+        access['allowed'] = True
+
+        with flask_app.test_request_context():
+            assert forms.chunkedupload.get_upload_url() == '/easyforms/upload/'
+
+        # Uploads over the limit, or in the wrong number of chunks, are refused up front
+        assert client.post('/easyforms/upload/start', json={
+            'filename': 'data.bin', 'size': 5001, 'chunk_count': 6
+        }).status_code == 413
+        assert client.post('/easyforms/upload/start', json={
+            'filename': 'data.bin', 'size': len(contents), 'chunk_count': 3000
+        }).status_code == 400
+
+        # As are new uploads once the store is full
+        assert client.post('/easyforms/upload/start', json={
+            'filename': 'other.bin', 'size': 4000, 'chunk_count': 4
+        }).status_code == 200
+        assert client.post('/easyforms/upload/start', json={
+            'filename': 'data.bin', 'size': len(contents), 'chunk_count': 3
+        }).status_code == 503
+        store.max_age = -1
+        store.cleanup()
+        store.max_age = 60
+
+        response = client.post('/easyforms/upload/start', json={
+            'filename': 'data.bin', 'size': len(contents), 'chunk_count': 3
+        })
+        upload_id = response.get_json()['upload_id']
+
+        # Chunks can arrive in any order, and the client can ask which have arrived to resume
+        assert client.put('/easyforms/upload/{}/2'.format(upload_id), data=contents[2000:]).status_code == 200
+        assert client.put('/easyforms/upload/{}/0'.format(upload_id), data=contents[:1000]).status_code == 200
+        assert client.get('/easyforms/upload/{}'.format(upload_id)).get_json()['received'] == [0, 2]
+        assert client.post('/easyforms/upload/{}/complete'.format(upload_id)).status_code == 400
+
+        assert client.put('/easyforms/upload/{}/1'.format(upload_id), data=b'x' * 1001).status_code == 413
+        # Chunks can't go beyond the declared size
+        assert client.put('/easyforms/upload/{}/2'.format(upload_id), data=contents[2000:] + b'x').status_code == 413
+        assert client.put('/easyforms/upload/{}/1'.format(upload_id), data=contents[1000:2000]).status_code == 200
+        token = client.post('/easyforms/upload/{}/complete'.format(upload_id)).get_json()['token']
+        assert client.get('/easyforms/upload/../../etc').status_code == 404
+
+        def process(token):
+            field = forms.FileUploadField('upload', accept='*', chunked=True, hash_algorithm='md5')
+            form = Form([field], read_form_data=False)
+            form.process(forms.Submission({Form.SUBMITTED_HIDDEN_INPUT_NAME: '1', field.token_name: token}))
+            return field
+
+        field = process(token)
+        assert field.value == contents
+        assert field.filename == 'data.bin'
+        assert field.upload_token == token
+        assert field.file.stream.closed
+
+        # The upload is removed once it has been used, so the token only works once
+        assert tmpdir.listdir() == []
+        field = process(token)
+        assert field.value is None
+        assert field.error
+
+        field = process('not-a-real-token')
+        assert field.value is None
+        assert field.error
+
+        # Header only images still decode once the upload has been claimed
+        buffer = io.BytesIO()
+        Image.new('RGB', (120, 80), 'red').save(buffer, 'PNG')
+        image_bytes = buffer.getvalue()
+        assert len(image_bytes) <= 1000
+
+        upload_id = client.post('/easyforms/upload/start', json={
+            'filename': 'red.png', 'size': len(image_bytes), 'chunk_count': 1
+        }).get_json()['upload_id']
+        client.put('/easyforms/upload/{}/0'.format(upload_id), data=image_bytes)
+        token = client.post('/easyforms/upload/{}/complete'.format(upload_id)).get_json()['token']
+
+        field = forms.ImageUploadField('image', chunked=True, header_only=True)
+        Form([field], read_form_data=False).process(forms.Submission(
+            {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1', field.token_name: token}
+        ))
+        assert field.value.size == (120, 80)
+        assert field.value.getpixel((0, 0)) == (255, 0, 0)
+        assert field.raw_image_data == image_bytes
+    finally:
+        forms.chunkedupload.set_chunk_store(None)
+
+
+def test_image_derivatives():
+    import io
+    from PIL import Image
+    from werkzeug.datastructures import FileStorage
+
+    buffer = io.BytesIO()
+    Image.new('RGBA', (400, 200), 'blue').save(buffer, 'PNG')
+    image_bytes = buffer.getvalue()
+
+    derivatives = [
+        forms.imagederivatives.Derivative('thumbnail', max_width=100, max_height=100),
+        forms.imagederivatives.Derivative('large', max_width=1000, format='PNG')
+    ]
+
+    def process(**kwargs):
+        field = forms.ImageUploadField('image', derivatives=derivatives, **kwargs)
+        form = Form([field], read_form_data=False)
+        form.process(forms.Submission(
+            {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1'},
+            files={'image': FileStorage(io.BytesIO(image_bytes), filename='blue.png')}
+        ))
+        return field
+
+    def check(field):
+        results = field.derivative_future.result(timeout=10)
+        thumbnail = Image.open(io.BytesIO(results['thumbnail']))
+        assert (thumbnail.format, thumbnail.size, thumbnail.mode) == ('JPEG', (100, 50), 'RGB')
+        # Images are never enlarged
+        assert Image.open(io.BytesIO(results['large'])).size == (400, 200)
+        # The field's image is left alone
+        assert field.value.size == (400, 200)
+
+    check(process())
+
+    forms.imagederivatives.init_derivative_executor(max_workers=1, max_pending=1)
+    try:
+        check(process(header_only=True))
+    finally:
+        forms.imagederivatives.set_derivative_executor(None)
+
+    field = forms.ImageUploadField('image', derivatives=derivatives, min_image_width=1000)
+    Form([field], read_form_data=False).process(forms.Submission(
+        {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1'},
+        files={'image': FileStorage(io.BytesIO(image_bytes), filename='blue.png')}
+    ))
+    assert field.derivative_future is None
+
+
+def test_content_index(tmpdir):
+    import hashlib
+    import io
+    from werkzeug.datastructures import FileStorage
+
+    def process(index, contents):
+        field = forms.FileUploadField('upload', accept='*', content_index=index)
+        form = Form([field], read_form_data=False)
+        form.process(forms.Submission(
+            {Form.SUBMITTED_HIDDEN_INPUT_NAME: '1'},
+            files={'upload': FileStorage(io.BytesIO(contents), filename='logo.png')}
+        ))
+        return field
+
+    for index in [forms.contentindex.MemoryContentIndex(max_entries=2),
+                  forms.contentindex.DirectoryContentIndex(str(tmpdir))]:
+        field = process(index, b'logo')
+        assert field.value == b'logo'
+        assert field.digest == hashlib.sha256(b'logo').hexdigest()
+        assert not field.duplicate
+        field.remember_content('logos/1.png')
+
+        field = process(index, b'logo')
+        assert field.duplicate
+        assert field.known_content == 'logos/1.png'
+        assert not process(index, b'other').duplicate
+
+    index = forms.contentindex.MemoryContentIndex(max_entries=2)
+    for digest in ['aa', 'bb', 'cc']:
+        index.add(digest)
+    assert index.get('aa') is None
+    assert len(index) == 2
+
+
+def test_parked_upload(tmpdir):
+    import io
+    from werkzeug.datastructures import FileStorage
+
+    flask_app = create_test_app()
+    flask_app.secret_key = 'testing'
+    store = forms.parkedupload.init_parked_uploads(flask_app, str(tmpdir), ttl=60)
+
+    try:
+        def process(data, files=None):
+            data[Form.SUBMITTED_HIDDEN_INPUT_NAME] = '1'
+            form = Form([
+                forms.TextField('name', required=True),
+                forms.FileUploadField('upload', accept='*', park_uploads=True)
+            ], read_form_data=False)
+            form.process(forms.Submission(data, files=files))
+            return form
+
+        form = process({'name': ''}, files={'upload': FileStorage(io.BytesIO(b'contents'), filename='a.txt')})
+        assert not form.ready
+        field = form.get_field('upload')
+        assert len(tmpdir.listdir()) == 0
+
+        # The upload is only parked when the form is shown again
+        with flask_app.test_request_context():
+            html = form.render()
+            token = field.parked_token
+            assert len(tmpdir.listdir()) == 1
+            assert 'name="upload-parked-token" value="{}"'.format(token) in html
+            assert 'a.txt has been uploaded' in html
+
+            form = process({'name': 'Bob', 'upload-parked-token': token},
+                           files={'upload': FileStorage(io.BytesIO(b''), filename='')})
+            assert form.ready
+            assert form['upload'] == b'contents'
+            assert form.get_field('upload').filename == 'a.txt'
+            assert form.get_field('upload').file.stream.closed
+
+            # A new file replaces the parked one
+            form = process({'name': 'Bob', 'upload-parked-token': token},
+                           files={'upload': FileStorage(io.BytesIO(b'new'), filename='b.txt')})
+            assert form['upload'] == b'new'
+
+            form = process({'name': 'Bob', 'upload-parked-token': token + 'x'})
+            assert not form.ready
+            assert form.get_field('upload').error
+
+            # Tokens only work for the field they were issued for
+            assert store.open(token, 'other') is None
+
+        # and in the session they were issued in
+        with flask_app.test_request_context():
+            form = process({'name': 'Bob', 'upload-parked-token': token})
+            assert not form.ready
+            assert form.get_field('upload').error
+
+        store.ttl = -1
+        store.cleanup()
+        assert len(tmpdir.listdir()) == 0
+    finally:
+        forms.parkedupload.set_parking_store(None)
+
+
+def test_image_upload_client_resize(app):
+    def render(**kwargs):
+        form = Form([forms.ImageUploadField('image', **kwargs)], read_form_data=False)
+        with app.test_request_context():
+            return form.render()
+
+    assert 'createImageBitmap' not in render(max_image_width=800)
+    assert 'createImageBitmap' not in render(client_resize=True)
+
+    html = render(max_image_width=800, max_image_height=600, client_resize=True,
+                  client_resize_quality=0.8)
+    assert 'var maxWidth = 800;' in html
+    assert 'var maxHeight = 600;' in html
+    assert 'var quality = 0.8;' in html
+
+
+def test_recaptcha_verifier():
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs
+
+    status = {'code': 200}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            data = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+            body = json.dumps({'success': data['response'] == ['good']}).encode()
+            self.send_response(status['code'])
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/siteverify'.format(server.server_port)
+
+    def process(verifier, response):
+        field = forms.RecaptchaField('captcha', 'site', 'secret', verifier=verifier)
+        Form([field], read_form_data=False).process(forms.Submission({
+            Form.SUBMITTED_HIDDEN_INPUT_NAME: '1', 'g-recaptcha-response': response
+        }))
+        return field
+
+    try:
+        verifier = forms.recaptcha.RecaptchaVerifier(url=url, failure_threshold=2, reset_timeout=60)
+        assert process(verifier, 'good').value is True
+        assert process(verifier, 'bad').value is None
+
+        # Failures open the circuit, after which the service isn't called
+        status['code'] = 500
+        for i in range(2):
+            assert process(verifier, 'good').error == 'Unable to check the recaptcha.  Please try again'
+        assert verifier.circuit_open
+        status['code'] = 200
+        assert process(verifier, 'good').error
+
+        verifier.reset_timeout = 0
+        assert process(verifier, 'good').value is True
+        assert not verifier.circuit_open
+
+        verifier = forms.recaptcha.RecaptchaVerifier(url=url, fail_open=True, failure_threshold=1)
+        status['code'] = 503
+        assert process(verifier, 'bad').value is True
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_recaptcha_remember_verification():
+    flask_app = create_test_app()
+    flask_app.secret_key = 'testing'
+
+    class StubVerifier(object):
+        calls = 0
+
+        def verify(self, secret_key, response, remote_addr=None):
+            self.calls += 1
+            return response == 'good'
+
+    verifier = StubVerifier()
+
+    def create_form(form_name='contact'):
+        return Form([
+            forms.TextField('name', required=True),
+            forms.RecaptchaField('captcha', 'site', 'secret', verifier=verifier, remember_for=60)
+        ], read_form_data=False, form_name=form_name)
+
+    def process(form, data):
+        data[form.submitted_hidden_input_name] = '1'
+        form.process(forms.Submission(data))
+        return form
+
+    with flask_app.test_request_context():
+        assert 'g-recaptcha' in create_form().render()
+
+        form = process(create_form(), {'name': '', 'g-recaptcha-response': 'good'})
+        assert not form.ready
+        assert form['captcha'] is True
+        assert verifier.calls == 1
+
+        # The recaptcha isn't shown or checked again for this form
+        assert 'g-recaptcha' not in form.render()
+        form = process(create_form(), {'name': 'Bob'})
+        assert form.ready
+        assert verifier.calls == 1
+
+        # Other forms still need their own recaptcha
+        assert 'g-recaptcha' in create_form('other').render()
+
+        form.get_field('captcha').forget_verification()
+        form = process(create_form(), {'name': 'Bob'})
+        assert not form.ready
+
+        # Unnamed forms can't remember the recaptcha, as they would all share one marker
+        with pytest.raises(ValueError):
+            create_form('').render()
+        with pytest.raises(ValueError):
+            process(create_form(''), {'name': 'Bob', 'g-recaptcha-response': 'good'})